@@ -0,0 +1,147 @@
+"""Exact-match response cache for LLM calls."""
+
+import asyncio
+import functools
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional
+
+import orjson
+from cachetools import TTLCache
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+from config import (
+    LLM_CACHE_ENABLED,
+    LLM_CACHE_TTL,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_MAX_IMAGE_BYTES,
+    REDIS_URL,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# L1: in-process, L2: Redis (shared across workers, optional)
+_local_cache = TTLCache(maxsize=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL)
+_redis = aioredis.from_url(REDIS_URL) if aioredis and REDIS_URL else None
+
+# Single-flight: concurrent identical misses share one upstream call
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _digest_bytes(value: Any) -> str:
+    """orjson fallback: hash raw image bytes instead of serializing them."""
+    if isinstance(value, (bytes, bytearray)):
+        return hashlib.blake2b(value, digest_size=16).hexdigest()
+    raise TypeError
+
+
+def _cache_key(model: str, messages: List[Dict[str, Any]]) -> str:
+    """Build a deterministic cache key from the model and messages."""
+    encoded = orjson.dumps(messages, option=orjson.OPT_SORT_KEYS, default=_digest_bytes)
+    digest = hashlib.blake2b(encoded, digest_size=16).hexdigest()
+    return f"llm:{model}:{digest}"
+
+
+def _is_cacheable(messages: List[Dict[str, Any]]) -> bool:
+    """Skip caching for requests carrying large inline images."""
+    image_bytes = 0
+    for msg in messages:
+        content = msg.get('content')
+        if isinstance(content, list):
+            for item in content:
+                if item.get('type') == 'image':
+                    image_bytes += len(item['data'])
+    return image_bytes <= LLM_CACHE_MAX_IMAGE_BYTES
+
+
+async def lookup(key: str) -> Optional[Dict[str, Any]]:
+    """Look up a cached response, checking the local cache before Redis."""
+    value = _local_cache.get(key)
+    if value is not None:
+        return value
+
+    if _redis is not None:
+        try:
+            raw = await _redis.get(key)
+        except Exception as e:
+            logger.error("Redis cache read failed: %s", e)
+            return None
+        if raw is not None:
+            value = orjson.loads(raw)
+            _local_cache[key] = value
+            return value
+
+    return None
+
+
+async def store(key: str, value: Dict[str, Any], ttl: int = LLM_CACHE_TTL):
+    """Store a response in the local cache and Redis."""
+    _local_cache[key] = value
+
+    if _redis is not None:
+        try:
+            await _redis.setex(key, ttl, orjson.dumps(value))
+        except Exception as e:
+            logger.error("Redis cache write failed: %s", e)
+
+
+def _replay(result: Optional[Dict[str, Any]], on_delta) -> Optional[Dict[str, Any]]:
+    """Deliver a cached response to a streaming caller as a single delta."""
+    if on_delta and result and result.get('content'):
+        on_delta(result['content'])
+    return result
+
+
+def cached_call(func):
+    """
+    Cache the result of an LLM query function keyed by (model, messages).
+
+    Failed calls (None) are never cached. While a call is in flight,
+    identical concurrent calls await its result instead of issuing their own.
+    If that call is cancelled or raises, they retry, and one of them makes
+    the call itself.
+    """
+    @functools.wraps(func)
+    async def wrapper(model: str, messages: List[Dict[str, Any]], *args, **kwargs):
+        if not LLM_CACHE_ENABLED or not _is_cacheable(messages):
+            return await func(model, messages, *args, **kwargs)
+
+        key = _cache_key(model, messages)
+        while True:
+            cached = await lookup(key)
+            if cached is not None:
+                return _replay(cached, kwargs.get('on_delta'))
+
+            pending = _inflight.get(key)
+            if pending is None:
+                break
+            try:
+                # Shield so a cancelled follower doesn't cancel the shared call
+                return _replay(await asyncio.shield(pending), kwargs.get('on_delta'))
+            except asyncio.CancelledError:
+                # The leader belonged to another request; only give up if we were cancelled
+                if pending.cancelled():
+                    continue
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        _inflight[key] = future
+        try:
+            result = await func(model, messages, *args, **kwargs)
+            if result is not None:
+                await store(key, result)
+        except BaseException:
+            # Followers retry instead of inheriting this request's failure
+            future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            _inflight.pop(key, None)
+
+    return wrapper
@@ -3,7 +3,13 @@
 import os
 from dotenv import load_dotenv
 
-load_dotenv()
+# Settings are resolved once at import; backend modules import them from here
+# rather than reading the environment themselves.
+# Skip re-parsing .env when a parent process (e.g. the uvicorn supervisor)
+# already loaded it into the inherited environment.
+if not os.environ.get("_DOTENV_LOADED"):
+    load_dotenv()
+    os.environ["_DOTENV_LOADED"] = "1"
 
 # API Keys for direct access
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -26,4 +32,47 @@ CHAIRMAN_MODEL = "google/gemini-3-pro-preview"
 # Data directory for conversation storage (fallback)
 DATA_DIR = "data/conversations"
 
+# Exact-match response cache for LLM calls
+# In-process TTL cache, optionally backed by Redis when REDIS_URL is set.
+# Off by default: every council call is sampled (temperature > 0), so a hit
+# would replay one earlier sample word for word instead of a fresh answer.
+# Conversation titles use the same store regardless of this flag.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "false").lower() == "true"
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ENTRIES = 10_000
+# Skip caching requests whose inline images exceed this many bytes
+LLM_CACHE_MAX_IMAGE_BYTES = 750_000
+REDIS_URL = os.getenv("REDIS_URL")
+# Generated conversation titles are kept much longer than responses
+TITLE_CACHE_TTL = int(os.getenv("TITLE_CACHE_TTL", str(30 * 86400)))
 
+# Semantic cache for Stage 1 (paraphrased first questions)
+# Requires the optional sentence-transformers / faiss-cpu dependencies.
+# Opt-in, like LLM_CACHE_ENABLED: a hit replays Stage 1 answers generated
+# for someone else's (merely similar) question instead of fresh samples.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MODEL = "all-MiniLM-L6-v2"
+SEMANTIC_CACHE_DIR = "data/semantic_cache"
+
+# Once all but one council member have answered, Stage 1 drops the last one
+# if it stops streaming for STAGE1_GRACE_MS, or if it has not sent its first
+# token within STAGE1_FIRST_TOKEN_MS (reasoning models stream nothing while
+# they think; see iter_models_firstN). Councils of fewer than three models
+# always wait for every member.
+STAGE1_GRACE_MS = int(os.getenv("STAGE1_GRACE_MS", "2000"))
+STAGE1_FIRST_TOKEN_MS = int(os.getenv("STAGE1_FIRST_TOKEN_MS", "60000"))
+
+# Skip Stage 2 when all Stage 1 responses are at least this similar
+# (uses the semantic cache encoder, whether or not the cache itself is
+# enabled; no-op when it isn't installed)
+STAGE2_SKIP_SIMILARITY = float(os.getenv("STAGE2_SKIP_SIMILARITY", "0.95"))
+
+# Per-response token budget for the Stage 2 ranking prompt; longer Stage 1
+# answers are truncated there (Stage 3 still sees them in full)
+STAGE2_RESPONSE_MAX_TOKENS = int(os.getenv("STAGE2_RESPONSE_MAX_TOKENS", "1500"))
+
+# uvicorn workers (also read by the uvicorn CLI). Keep at 1: the conversation
+# cache, in-flight request maps and semantic cache index are per-process, so
+# extra workers would serve stale history and overwrite each other's index.
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
@@ -1,15 +1,114 @@
 """3-stage LLM Council orchestration."""
 
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Callable, AsyncIterator
+import asyncio
 import base64
+import functools
+import hashlib
 import io
+import re
+import string
+import logging
+import threading
 try:
     from pypdf import PdfReader
 except ImportError:
     PdfReader = None
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from cachetools import LRUCache
+
+from llm_client import iter_models_firstN, iter_models_batched, query_model
+from config import (
+    COUNCIL_MODELS,
+    CHAIRMAN_MODEL,
+    STAGE1_GRACE_MS,
+    STAGE1_FIRST_TOKEN_MS,
+    STAGE2_SKIP_SIMILARITY,
+    STAGE2_RESPONSE_MAX_TOKENS,
+    TITLE_CACHE_TTL,
+)
+import cache
+import semantic_cache
+
+logger = logging.getLogger(__name__)
+
+
+# Stage 2 ranking parsing; the numbered pattern captures the label directly
+_NUMBERED_RANKING_RE = re.compile(r'\d+\.\s*(Response [A-Z])')
+_RESPONSE_LABEL_RE = re.compile(r'Response [A-Z]')
+
+# Anonymized labels in council order: "Response A", "Response B", ...
+_RESPONSE_LABELS = tuple(f"Response {letter}" for letter in string.ascii_uppercase)
+
+# Titles need at least one word character
+_WORD_RE = re.compile(r'\w')
+
+# Token budget for the conversation context in the ranking prompt
+_HISTORY_CONTEXT_MAX_TOKENS = 500
+
+# Tokenizer used to enforce prompt budgets, loaded by warm_tokenizer().
+# Until it is ready (or if it can't be fetched) budgets use a ~4
+# characters/token estimate.
+_ENCODING = None
+_CHARS_PER_TOKEN = 4
+
+# Extracted PDF text keyed by SHA-256 of the base64 payload, so re-sent
+# history attachments are not parsed again on every turn
+_pdf_text_cache = LRUCache(maxsize=64)
+_pdf_text_lock = threading.Lock()
+
+# Static prompt prefixes. Keep these byte-identical across calls so the
+# providers' prompt-prefix caches hit; per-turn data goes in the user message.
+RANKING_SYSTEM = """You are evaluating different responses to a question. The question and the anonymized responses from different models are given in the user message.
+
+Your task:
+1. First, evaluate each response individually. For each response, explain what it does well and what it does poorly.
+2. Then, at the very end of your response, provide a final ranking.
+
+IMPORTANT: Your final ranking MUST be formatted EXACTLY as follows:
+- Start with the line "FINAL RANKING:" (all caps, with colon)
+- Then list the responses from best to worst as a numbered list
+- Each line should be: number, period, space, then ONLY the response label (e.g., "1. Response A")
+- Do not add any other text or explanations in the ranking section
+
+Example of the correct format for your ENTIRE response:
+
+Response A provides good detail on X but misses Y...
+Response B is accurate but lacks depth on Z...
+Response C offers the most comprehensive answer...
+
+FINAL RANKING:
+1. Response C
+2. Response A
+3. Response B"""
+
+RANKING_TEMPLATE = string.Template("""Question: $question$context
+
+Here are the responses from different models (anonymized):
+
+$responses
+
+Now provide your evaluation and ranking:""")
+
+CHAIRMAN_SYSTEM = """You are the Chairman of an LLM Council. Multiple AI models have provided responses to the user's latest question, and then ranked each other's responses. The user's question, the individual responses (Stage 1) and the peer rankings (Stage 2) are given in the final message.
+
+Your task as Chairman is to synthesize all of this information into a single, comprehensive, accurate answer to the user's question. Consider:
+- The individual responses and their insights
+- The peer rankings and what they reveal about response quality
+- Any patterns of agreement or disagreement
+
+Provide a clear, well-reasoned final answer that represents the council's collective wisdom. Do not explicitly mention "Stage 1" or "Stage 2" in your final answer unless necessary to explain a conflict. Speak directly to the user."""
+
 
-from llm_client import query_models_parallel, query_model
-from config import COUNCIL_MODELS, CHAIRMAN_MODEL
+def _strip_data_uri(data: str) -> str:
+    """Return the base64 payload of a `data:<mime>;base64,` URI, or the input unchanged."""
+    if data.startswith("data:"):
+        return data[data.index(",") + 1:]
+    return data
 
 
 def extract_text_from_pdf(base64_data: str) -> str:
@@ -18,16 +117,22 @@ def extract_text_from_pdf(base64_data: str) -> str:
         return "[PDF processing unavailable - pypdf not installed]"
         
     try:
-        # Check if data contains header, strip if needed
-        if "," in base64_data[:100]:
-            base64_data = base64_data.split(",", 1)[1]
-            
-        pdf_bytes = base64.b64decode(base64_data)
-        reader = PdfReader(io.BytesIO(pdf_bytes))
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        base64_data = _strip_data_uri(base64_data)
+        key = hashlib.sha256(base64_data.encode()).hexdigest()
+        with _pdf_text_lock:
+            cached = _pdf_text_cache.get(key)
+        if cached is not None:
+            return cached
+
+        # BytesIO shares the decoded buffer rather than copying it
+        reader = PdfReader(io.BytesIO(base64.b64decode(base64_data)))
+        # Collect pages and join once; repeated += is quadratic on large PDFs
+        parts = [page.extract_text() or "" for page in reader.pages]
+        text = "\n".join(parts).strip()
+
+        with _pdf_text_lock:
+            _pdf_text_cache[key] = text
+        return text
     except Exception as e:
         return f"[Error extracting PDF text: {str(e)}]"
 
@@ -35,17 +140,28 @@ def extract_text_from_pdf(base64_data: str) -> str:
 def decode_text_file(base64_data: str) -> str:
     """Decode base64 encoded text file."""
     try:
-        if "," in base64_data[:100]:
-            base64_data = base64_data.split(",", 1)[1]
-        return base64.b64decode(base64_data).decode('utf-8')
+        return base64.b64decode(_strip_data_uri(base64_data)).decode('utf-8')
     except Exception as e:
         return f"[Error decoding file: {str(e)}]"
 
 
-def process_message_content(content: str, attachments: List[Dict[str, Any]] = None) -> Any:
+def decode_image(base64_data: str) -> Optional[bytes]:
+    """Decode a base64 encoded image to raw bytes (None if invalid)."""
+    try:
+        return base64.b64decode(_strip_data_uri(base64_data))
+    except Exception:
+        return None
+
+
+async def process_message_content(content: str, attachments: List[Dict[str, Any]] = None) -> Any:
     """
     Process message content and attachments into LLM-ready format.
     Handles text extraction from docs and image formatting.
+
+    Images become {"type": "image", "mime": ..., "data": <raw bytes>} parts.
+
+    Decoding and PDF parsing run in a worker thread so they don't block
+    the event loop for other requests.
     """
     text_content = content or ""
     image_parts = []
@@ -57,23 +173,24 @@ def process_message_content(content: str, attachments: List[Dict[str, Any]] = No
             name = att.get('name', 'file')
             
             if mime_type == 'application/pdf':
-                pdf_text = extract_text_from_pdf(data)
+                pdf_text = await asyncio.to_thread(extract_text_from_pdf, data)
                 text_content += f"\n\n[Attachment: {name} (PDF Content)]\n{pdf_text}\n[End Attachment]"
                 
             elif mime_type.startswith('text/') or mime_type in ['application/json', 'application/javascript', 'application/csv']:
-                decoded = decode_text_file(data)
+                decoded = await asyncio.to_thread(decode_text_file, data)
                 text_content += f"\n\n[Attachment: {name}]\n{decoded}\n[End Attachment]"
                 
             elif mime_type.startswith('image/'):
-                # Format for OpenAI (handled by llm_client for Gemini conversion)
-                if "," not in data[:100]:
-                    data_url = f"data:{mime_type};base64,{data}"
-                else:
-                    data_url = data # Already has prefix
-                    
+                # Keep raw bytes; llm_client encodes them per provider
+                image_bytes = await asyncio.to_thread(decode_image, data)
+                if image_bytes is None:
+                    text_content += f"\n\n[Attachment: {name} (image could not be decoded)]"
+                    continue
+
                 image_parts.append({
-                    "type": "image_url",
-                    "image_url": {"url": data_url}
+                    "type": "image",
+                    "mime": mime_type,
+                    "data": image_bytes
                 })
     
     # If no images, just return text
@@ -89,18 +206,23 @@ def process_message_content(content: str, attachments: List[Dict[str, Any]] = No
     return final_content
 
 
-def build_chat_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+async def build_chat_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """Convert stored history into LLM message format."""
+    # Process all user turns (and their attachments) concurrently
+    user_msgs = [msg for msg in history if msg.get('role') == 'user']
+    processed_list = await asyncio.gather(*[
+        process_message_content(msg.get('content', ''), msg.get('attachments', []))
+        for msg in user_msgs
+    ])
+    processed_iter = iter(processed_list)
+
     llm_messages = []
     
     for msg in history:
         role = msg.get('role')
         
         if role == 'user':
-            content = msg.get('content', '')
-            attachments = msg.get('attachments', [])
-            processed = process_message_content(content, attachments)
-            llm_messages.append({"role": "user", "content": processed})
+            llm_messages.append({"role": "user", "content": next(processed_iter)})
             
         elif role == 'assistant':
             # For assistant, we use the final synthesis (Stage 3)
@@ -116,122 +238,182 @@ def build_chat_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     return llm_messages
 
 
-async def stage1_collect_responses(
+def in_council_order(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sort per-model results (which arrive in completion order) by seat."""
+    return sorted(results, key=lambda result: COUNCIL_MODELS.index(result['model']))
+
+
+async def stage1_stream(
     user_query: str, 
-    history: List[Dict[str, Any]], 
-    attachments: List[Dict[str, Any]] = None
-) -> List[Dict[str, Any]]:
+    processed_history: List[Dict[str, Any]], 
+    attachments: List[Dict[str, Any]] = None,
+    on_delta: Optional[Callable[[str, str], None]] = None
+) -> AsyncIterator[Dict[str, Any]]:
     """
-    Stage 1: Collect individual responses from all council models.
+    Stage 1: Yield each council model's response as soon as it arrives.
+
+    `processed_history` is the output of build_chat_history(). If
+    `on_delta` is given, responses are streamed and it receives
+    (model, delta) for every text delta. Failed models are skipped.
     """
-    # Build history
-    messages = build_chat_history(history)
+    current_content = await process_message_content(user_query, attachments)
     
-    # Add current message
-    current_content = process_message_content(user_query, attachments)
-    messages.append({"role": "user", "content": current_content})
-
-    # Query all models in parallel
-    responses = await query_models_parallel(COUNCIL_MODELS, messages)
-
-    # Format results
+    # Add current message (copy, the history is shared with Stage 3)
+    messages = [*processed_history, {"role": "user", "content": current_content}]
+
+    # Paraphrases of an earlier opening question reuse its Stage 1 results.
+    # Only first turns without attachments qualify: history changes the
+    # answer, and attached text is merged into the query where similar
+    # openings ("Summarize this") would match different files. Queries
+    # longer than the encoder window are skipped by the cache itself.
+    use_semantic_cache = not processed_history and not attachments and current_content.strip()
+    if use_semantic_cache:
+        cached = await semantic_cache.lookup(current_content, COUNCIL_MODELS)
+        if cached:
+            for result in cached:
+                yield result
+            return
+
+    # Query all models in parallel; once all but one have answered, a last
+    # one that has stopped streaming is dropped instead of holding up the
+    # whole council. Two-seat councils wait for both: losing one seat would
+    # also skip Stage 2.
     stage1_results = []
-    for model, response in responses.items():
+    async for model, response in iter_models_firstN(
+        COUNCIL_MODELS,
+        messages,
+        min_responses=len(COUNCIL_MODELS) - 1 if len(COUNCIL_MODELS) >= 3 else len(COUNCIL_MODELS),
+        grace_ms=STAGE1_GRACE_MS,
+        first_token_ms=STAGE1_FIRST_TOKEN_MS,
+        on_delta=on_delta
+    ):
         if response is not None:  # Only include successful responses
-            stage1_results.append({
+            result = {
                 "model": model,
                 "response": response.get('content', '')
-            })
+            }
+            stage1_results.append(result)
+            yield result
 
-    return stage1_results
+    # Only cache complete councils so a transient failure isn't replayed
+    if use_semantic_cache and len(stage1_results) == len(COUNCIL_MODELS):
+        await semantic_cache.store(current_content, COUNCIL_MODELS, in_council_order(stage1_results))
 
 
-async def stage2_collect_rankings(
-    user_query: str,
-    stage1_results: List[Dict[str, Any]],
-    history_context: str = ""
-) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
-    """
-    Stage 2: Each model ranks the anonymized responses.
+async def stage1_collect_responses(
+    user_query: str, 
+    processed_history: List[Dict[str, Any]], 
+    attachments: List[Dict[str, Any]] = None,
+    on_delta: Optional[Callable[[str, str], None]] = None
+) -> List[Dict[str, Any]]:
     """
-    # Create anonymized labels for responses (Response A, Response B, etc.)
-    labels = [chr(65 + i) for i in range(len(stage1_results))]  # A, B, C, ...
-
-    # Create mapping from label to model name
-    label_to_model = {
-        f"Response {label}": result['model']
-        for label, result in zip(labels, stage1_results)
-    }
+    Stage 1: Collect individual responses from all council models.
 
-    # Build the ranking prompt
-    responses_text = "\n\n".join([
-        f"Response {label}:\n{result['response']}"
-        for label, result in zip(labels, stage1_results)
+    Same as stage1_stream, gathered into a list in council order.
+    """
+    return in_council_order([
+        result async for result in stage1_stream(user_query, processed_history, attachments, on_delta)
     ])
 
-    context_str = ""
-    if history_context:
-        context_str = f"\n\nContext from previous conversation:\n{history_context[-2000:]}..." # Limit context size
-
-    ranking_prompt = f"""You are evaluating different responses to the following question:
 
-Question: {user_query}{context_str}
-
-Here are the responses from different models (anonymized):
-
-{responses_text}
+def anonymize_responses(stage1_results: List[Dict[str, Any]]) -> Dict[str, str]:
+    """
+    Map anonymized labels ("Response A", ...) to the Stage 1 models, in order.
+    """
+    return {
+        label: result['model']
+        for label, result in zip(_RESPONSE_LABELS, stage1_results)
+    }
 
-Your task:
-1. First, evaluate each response individually. For each response, explain what it does well and what it does poorly.
-2. Then, at the very end of your response, provide a final ranking.
 
-IMPORTANT: Your final ranking MUST be formatted EXACTLY as follows:
-- Start with the line "FINAL RANKING:" (all caps, with colon)
-- Then list the responses from best to worst as a numbered list
-- Each line should be: number, period, space, then ONLY the response label (e.g., "1. Response A")
-- Do not add any other text or explanations in the ranking section
-
-Example of the correct format for your ENTIRE response:
+async def stage2_stream(
+    user_query: str,
+    stage1_results: List[Dict[str, Any]],
+    history_context: str = ""
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stage 2: Yield each model's ranking of the anonymized responses as it arrives.
 
-Response A provides good detail on X but misses Y...
-Response B is accurate but lacks depth on Z...
-Response C offers the most comprehensive answer...
+    Labels follow anonymize_responses(stage1_results). Yields nothing when
+    there is nothing meaningful to rank: fewer than two responses, or
+    responses that are near-identical.
+    """
+    if len(stage1_results) < 2:
+        return
 
-FINAL RANKING:
-1. Response C
-2. Response A
-3. Response B
+    similarity = await semantic_cache.min_pairwise_similarity(
+        [result['response'] for result in stage1_results]
+    )
+    if similarity is not None and similarity >= STAGE2_SKIP_SIMILARITY:
+        return
 
-Now provide your evaluation and ranking:"""
+    # Build the ranking prompt once; the same message goes to every model
+    responses_text = "\n\n".join(
+        f"{label}:\n{_truncate_tokens(result['response'], STAGE2_RESPONSE_MAX_TOKENS)}"
+        for label, result in zip(_RESPONSE_LABELS, stage1_results)
+    )
 
-    messages = [{"role": "user", "content": ranking_prompt}]
+    context_str = ""
+    if history_context:
+        context_str = (
+            "\n\nContext from previous conversation:\n"
+            + _truncate_tokens(history_context, _HISTORY_CONTEXT_MAX_TOKENS, keep_end=True)
+        )
+
+    ranking_prompt = RANKING_TEMPLATE.substitute(
+        question=user_query,
+        context=context_str,
+        responses=responses_text
+    )
 
-    # Get rankings from all council models in parallel
-    responses = await query_models_parallel(COUNCIL_MODELS, messages)
+    # Static instructions go first so providers can reuse the cached prefix
+    messages = [
+        {"role": "system", "content": RANKING_SYSTEM},
+        {"role": "user", "content": ranking_prompt},
+    ]
 
-    # Format results
-    stage2_results = []
-    for model, response in responses.items():
+    # Get rankings from all council models in parallel; a model seated more
+    # than once shares one batched request where the provider supports it
+    async for model, response in iter_models_batched(COUNCIL_MODELS, messages):
         if response is not None:
             full_text = response.get('content', '')
-            parsed = parse_ranking_from_text(full_text)
-            stage2_results.append({
+            yield {
                 "model": model,
                 "ranking": full_text,
-                "parsed_ranking": parsed
-            })
+                "parsed_ranking": parse_ranking_from_text(full_text)
+            }
+
+
+async def stage2_collect_rankings(
+    user_query: str,
+    stage1_results: List[Dict[str, Any]],
+    history_context: str = ""
+) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+    """
+    Stage 2: Each model ranks the anonymized responses.
 
-    return stage2_results, label_to_model
+    Same as stage2_stream, gathered into a list in council order, plus
+    the label-to-model mapping.
+    """
+    stage2_results = in_council_order([
+        ranking async for ranking in stage2_stream(user_query, stage1_results, history_context)
+    ])
+    return stage2_results, anonymize_responses(stage1_results)
 
 
 async def stage3_synthesize_final(
     user_query: str,
     stage1_results: List[Dict[str, Any]],
     stage2_results: List[Dict[str, Any]],
-    history: List[Dict[str, Any]] = None
+    processed_history: List[Dict[str, Any]] = None,
+    on_delta: Optional[Callable[[str, str], None]] = None
 ) -> Dict[str, Any]:
     """
     Stage 3: Chairman synthesizes final response.
+
+    `processed_history` is the output of build_chat_history(). If
+    `on_delta` is given, the synthesis is streamed and it receives
+    (model, delta) for every text delta.
     """
     # Build comprehensive context for chairman
     stage1_text = "\n\n".join([
@@ -246,31 +428,29 @@ async def stage3_synthesize_final(
     
     # Build history context
     # Note: For stage 3, we reconstruct the message history naturally so the chairman
-    # sees the full conversation flow, then we append the "Council Deliberation" data as a system or user prompt.
-    
-    messages = build_chat_history(history or [])
+    # sees the full conversation flow, then we append the "Council Deliberation" data as a user prompt.
+    # The static chairman instructions lead as a system message so the prefix is cacheable.
     
-    chairman_prompt = f"""You are the Chairman of an LLM Council. Multiple AI models have provided responses to the user's latest question, and then ranked each other's responses.
-
-User Question: {user_query}
+    chairman_prompt = f"""User Question: {user_query}
 
 STAGE 1 - Individual Responses from Council Members:
 {stage1_text}
 
 STAGE 2 - Peer Rankings and Evaluations:
-{stage2_text}
+{stage2_text}"""
 
-Your task as Chairman is to synthesize all of this information into a single, comprehensive, accurate answer to the user's question. Consider:
-- The individual responses and their insights
-- The peer rankings and what they reveal about response quality
-- Any patterns of agreement or disagreement
-
-Provide a clear, well-reasoned final answer that represents the council's collective wisdom. Do not explicitly mention "Stage 1" or "Stage 2" in your final answer unless necessary to explain a conflict. Speak directly to the user."""
-
-    messages.append({"role": "user", "content": chairman_prompt})
+    messages = [
+        {"role": "system", "content": CHAIRMAN_SYSTEM},
+        *(processed_history or []),
+        {"role": "user", "content": chairman_prompt},
+    ]
 
     # Query the chairman model
-    response = await query_model(CHAIRMAN_MODEL, messages)
+    response = await query_model(
+        CHAIRMAN_MODEL,
+        messages,
+        on_delta=functools.partial(on_delta, CHAIRMAN_MODEL) if on_delta else None
+    )
 
     if response is None:
         return {
@@ -284,30 +464,70 @@ Provide a clear, well-reasoned final answer that represents the council's collec
     }
 
 
+def _load_encoding():
+    global _ENCODING
+    try:
+        _ENCODING = tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        logger.warning("Tokenizer unavailable, estimating token counts: %s", e)
+
+
+def warm_tokenizer():
+    """
+    Load the tokenizer in a background thread.
+
+    tiktoken downloads its BPE file (without a timeout) unless
+    TIKTOKEN_CACHE_DIR already holds it, so this never runs on import or
+    on the event loop.
+    """
+    if tiktoken is not None and _ENCODING is None:
+        threading.Thread(target=_load_encoding, name="tiktoken-load", daemon=True).start()
+
+
+def _truncate_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """
+    Trim text to at most max_tokens tokens.
+
+    Args:
+        text: Text to trim
+        max_tokens: Token budget
+        keep_end: Keep the last tokens instead of the first
+
+    Returns:
+        The text itself if it fits, otherwise the trimmed text marked with "..."
+    """
+    encoding = _ENCODING
+    if encoding is None:
+        max_chars = max_tokens * _CHARS_PER_TOKEN
+        if len(text) <= max_chars:
+            return text
+        return "..." + text[-max_chars:] if keep_end else text[:max_chars] + "..."
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    if keep_end:
+        return "..." + encoding.decode(tokens[-max_tokens:])
+    return encoding.decode(tokens[:max_tokens]) + "..."
+
+
 def parse_ranking_from_text(ranking_text: str) -> List[str]:
     """
     Parse the FINAL RANKING section from the model's response.
     """
-    import re
-
-    # Look for "FINAL RANKING:" section
-    if "FINAL RANKING:" in ranking_text:
-        # Extract everything after "FINAL RANKING:"
-        parts = ranking_text.split("FINAL RANKING:")
-        if len(parts) >= 2:
-            ranking_section = parts[1]
-            # Try to extract numbered list format (e.g., "1. Response A")
-            numbered_matches = re.findall(r'\d+\.\s*Response [A-Z]', ranking_section)
-            if numbered_matches:
-                return [re.search(r'Response [A-Z]', m).group() for m in numbered_matches]
-
-            # Fallback: Extract all "Response X" patterns in order
-            matches = re.findall(r'Response [A-Z]', ranking_section)
-            return matches
+    # Look for the last "FINAL RANKING:" section
+    _, marker, ranking_section = ranking_text.rpartition("FINAL RANKING:")
+    if marker:
+        # Try to extract numbered list format (e.g., "1. Response A")
+        numbered_matches = _NUMBERED_RANKING_RE.findall(ranking_section)
+        if numbered_matches:
+            return numbered_matches
+
+        # Fallback: Extract all "Response X" patterns in order
+        return _RESPONSE_LABEL_RE.findall(ranking_section)
 
     # Fallback: try to find any "Response X" patterns in order
-    matches = re.findall(r'Response [A-Z]', ranking_text)
-    return matches
+    return _RESPONSE_LABEL_RE.findall(ranking_text)
 
 
 def calculate_aggregate_rankings(
@@ -317,30 +537,25 @@ def calculate_aggregate_rankings(
     """
     Calculate aggregate rankings across all models.
     """
-    from collections import defaultdict
-
-    # Track positions for each model
-    model_positions = defaultdict(list)
+    # Sum and count of positions per model, in a single pass over the
+    # rankings already parsed in Stage 2
+    totals: Dict[str, Tuple[int, int]] = {}
 
     for ranking in stage2_results:
-        ranking_text = ranking['ranking']
-        parsed_ranking = parse_ranking_from_text(ranking_text)
-
-        for position, label in enumerate(parsed_ranking, start=1):
-            if label in label_to_model:
-                model_name = label_to_model[label]
-                model_positions[model_name].append(position)
-
-    # Calculate average position for each model
-    aggregate = []
-    for model, positions in model_positions.items():
-        if positions:
-            avg_rank = sum(positions) / len(positions)
-            aggregate.append({
-                "model": model,
-                "average_rank": round(avg_rank, 2),
-                "rankings_count": len(positions)
-            })
+        for position, label in enumerate(ranking['parsed_ranking'], start=1):
+            model_name = label_to_model.get(label)
+            if model_name is not None:
+                total, count = totals.get(model_name, (0, 0))
+                totals[model_name] = (total + position, count + 1)
+
+    aggregate = [
+        {
+            "model": model,
+            "average_rank": round(total / count, 2),
+            "rankings_count": count
+        }
+        for model, (total, count) in totals.items()
+    ]
 
     # Sort by average rank (lower is better)
     aggregate.sort(key=lambda x: x['average_rank'])
@@ -349,7 +564,26 @@ def calculate_aggregate_rankings(
 
 
 async def generate_conversation_title(user_query: str) -> str:
-    """Generate a short title for a conversation."""
+    """
+    Generate a short title for a conversation.
+
+    Short queries are used as their own title; longer ones are titled by
+    the model and cached under the "title:" namespace.
+    """
+    words = user_query.split()
+    if not words:
+        return "New Conversation"
+    if len(words) <= 7:
+        title = " ".join(words[:5]).rstrip("?.!").strip()
+        # Punctuation-only queries ("?", "... !!") leave nothing to show
+        return title if _WORD_RE.search(title) else "New Conversation"
+
+    normalized = " ".join(words).lower()
+    key = f"title:{hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()}"
+    cached = await cache.lookup(key)
+    if cached is not None:
+        return cached['title']
+
     title_prompt = f"""Generate a very short title (3-5 words maximum) that summarizes the following question.
 The title should be concise and descriptive. Do not use quotes or punctuation in the title.
 
@@ -370,6 +604,7 @@ Title:"""
     if len(title) > 50:
         title = title[:47] + "..."
 
+    await cache.store(key, {"title": title}, ttl=TITLE_CACHE_TTL)
     return title
 
 
@@ -382,9 +617,12 @@ async def run_full_council(
     Run the complete 3-stage council process.
     """
     history = history or []
+
+    # Decode attachments and parse PDFs in the history once for all stages
+    processed_history = await build_chat_history(history)
     
     # Stage 1: Collect individual responses
-    stage1_results = await stage1_collect_responses(user_query, history, attachments)
+    stage1_results = await stage1_collect_responses(user_query, processed_history, attachments)
 
     if not stage1_results:
         return [], [], {
@@ -405,7 +643,7 @@ async def run_full_council(
         user_query,
         stage1_results,
         stage2_results,
-        history
+        processed_history
     )
 
     # Prepare metadata
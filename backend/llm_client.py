@@ -1,9 +1,65 @@
 """LLM Client for direct API calls to OpenAI and Google Gemini."""
 
 import httpx
-from typing import List, Dict, Any, Optional
-import re
+import orjson
+import asyncio
+import base64
+import functools
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Optional, AsyncIterator, Awaitable, Callable, Tuple
+from google import genai
+from google.genai import types as genai_types
 from config import OPENAI_API_KEY, GOOGLE_API_KEY
+from cache import cached_call
+
+logger = logging.getLogger(__name__)
+
+
+# The shared OpenAI client keeps TLS connections alive across calls and lets
+# the parallel council requests multiplex over HTTP/2. Bodies are encoded
+# and decoded with orjson rather than httpx's stdlib json.
+_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60)
+_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+_openai_client = httpx.AsyncClient(
+    base_url="https://api.openai.com",
+    headers={"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"},
+    http2=True,
+    timeout=_TIMEOUT,
+    limits=_LIMITS,
+)
+
+# Gemini goes through the google-genai SDK's async client
+_genai_client = genai.Client(api_key=GOOGLE_API_KEY) if GOOGLE_API_KEY else None
+
+_GEMINI_TEMPERATURE = 0.7
+_GEMINI_MAX_OUTPUT_TOKENS = 8192
+
+
+async def aclose():
+    """Close the shared HTTP clients (called on app shutdown)."""
+    await _openai_client.aclose()
+    if _genai_client is not None:
+        await _genai_client.aio.aclose()
+
+
+def _to_openai_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Encode raw-bytes image parts as the data-URL parts OpenAI expects."""
+    converted = []
+    for msg in messages:
+        content = msg['content']
+        if isinstance(content, list) and any(item['type'] == 'image' for item in content):
+            content = [
+                {
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{item['mime']};base64,{base64.b64encode(item['data']).decode()}"}
+                } if item['type'] == 'image' else item
+                for item in content
+            ]
+            msg = {**msg, 'content': content}
+        converted.append(msg)
+    return converted
 
 
 async def query_openai(model_name: str, messages: List[Dict[str, Any]], timeout: float = 120.0) -> Optional[Dict[str, Any]]:
@@ -18,178 +74,388 @@ async def query_openai(model_name: str, messages: List[Dict[str, Any]], timeout:
     Returns:
         Response dict with 'content', or None if failed
     """
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    
+    choices = await query_openai_choices(model_name, messages, 1, timeout)
+    return choices[0] if choices else None
+
+
+async def query_openai_choices(
+    model_name: str,
+    messages: List[Dict[str, Any]],
+    n: int,
+    timeout: float = 120.0
+) -> List[Dict[str, Any]]:
+    """
+    Request `n` independent completions from OpenAI in a single call.
+
+    The prompt is prefilled once and sampled `n` times, so this costs one
+    prompt's worth of input tokens instead of `n`.
+
+    Returns:
+        List of response dicts with 'content', or an empty list if failed
+    """
     payload = {
         "model": model_name,
-        "messages": messages,
+        "messages": _to_openai_messages(messages),
     }
+    if n > 1:
+        payload["n"] = n
     
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=payload
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            message = data['choices'][0]['message']
-            
-            return {
-                'content': message.get('content'),
-                'reasoning_details': message.get('reasoning_details')
+        response = await _openai_client.post(
+            "/v1/chat/completions",
+            content=orjson.dumps(payload),
+            timeout=httpx.Timeout(timeout, connect=10.0)
+        )
+        response.raise_for_status()
+        
+        data = orjson.loads(response.content)
+        
+        return [
+            {
+                'content': choice['message'].get('content'),
+                'reasoning_details': choice['message'].get('reasoning_details')
             }
+            for choice in data['choices']
+        ]
     
     except httpx.HTTPStatusError as e:
-        print(f"OpenAI API error for {model_name}: {e.response.status_code} - {e.response.text}")
-        return None
+        logger.error("OpenAI API error for %s: %s - %s", model_name, e.response.status_code, e.response.text)
+        return []
     except Exception as e:
-        print(f"Error querying OpenAI model {model_name}: {e}")
-        return None
+        logger.error("Error querying OpenAI model %s: %s", model_name, e)
+        return []
 
 
-async def query_gemini(model_name: str, messages: List[Dict[str, Any]], timeout: float = 120.0) -> Optional[Dict[str, Any]]:
-    """
-    Query Google Gemini API directly.
-    
-    Args:
-        model_name: Model name without provider prefix (e.g., "gemini-3-pro-preview")
-        messages: List of message dicts with 'role' and 'content' (str or list of parts)
-        timeout: Request timeout in seconds
-    
-    Returns:
-        Response dict with 'content', or None if failed
-    """
-    # Convert OpenAI-style messages to Gemini format
+def _build_gemini_sdk_request(messages: List[Dict[str, Any]], timeout: float) -> Tuple[List[Any], Any]:
+    """Convert OpenAI-style messages into google-genai contents and config."""
     contents = []
     system_instruction = None
-    
+
     for msg in messages:
         role = msg['role']
         content = msg['content']
-        
-        # Handle system message
+
         if role == 'system':
-            # Gemini system instructions must be text
             if isinstance(content, list):
-                text_parts = [p['text'] for p in content if p['type'] == 'text']
-                system_instruction = "\n".join(text_parts)
+                system_instruction = "\n".join(p['text'] for p in content if p['type'] == 'text')
             else:
                 system_instruction = content
             continue
-            
-        # Map roles
-        gemini_role = "model" if role == "assistant" else "user"
-        
-        parts = []
+
         if isinstance(content, str):
-            parts.append({"text": content})
-        elif isinstance(content, list):
+            parts = [genai_types.Part.from_text(text=content)]
+        else:
+            parts = []
             for item in content:
                 if item['type'] == 'text':
-                    parts.append({"text": item['text']})
-                elif item['type'] == 'image_url':
-                    # Parse data URI: data:image/png;base64,XXXX
-                    image_url = item['image_url']['url']
-                    match = re.match(r'data:([^;]+);base64,(.+)', image_url)
-                    if match:
-                        mime_type = match.group(1)
-                        data = match.group(2)
-                        parts.append({
-                            "inline_data": {
-                                "mime_type": mime_type,
-                                "data": data
-                            }
-                        })
-        
+                    parts.append(genai_types.Part.from_text(text=item['text']))
+                elif item['type'] == 'image':
+                    # Raw bytes go straight to the SDK, no base64 round-trip
+                    parts.append(genai_types.Part.from_bytes(data=item['data'], mime_type=item['mime']))
+
         if parts:
-            contents.append({
-                "role": gemini_role,
-                "parts": parts
-            })
+            contents.append(genai_types.Content(role="model" if role == "assistant" else "user", parts=parts))
+
+    config = genai_types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        temperature=_GEMINI_TEMPERATURE,
+        max_output_tokens=_GEMINI_MAX_OUTPUT_TOKENS,
+        http_options=genai_types.HttpOptions(timeout=int(timeout * 1000)),
+    )
+    return contents, config
+
+
+async def query_gemini(model_name: str, messages: List[Dict[str, Any]], timeout: float = 120.0) -> Optional[Dict[str, Any]]:
+    """
+    Query Google Gemini API directly.
     
-    payload = {
-        "contents": contents,
-        "generationConfig": {
-            "temperature": 0.7,
-            "maxOutputTokens": 8192,
-        }
-    }
+    Args:
+        model_name: Model name without provider prefix (e.g., "gemini-3-pro-preview")
+        messages: List of message dicts with 'role' and 'content' (str or list of parts)
+        timeout: Request timeout in seconds
     
-    if system_instruction:
-        payload["systemInstruction"] = {
-            "parts": [{"text": system_instruction}]
+    Returns:
+        Response dict with 'content', or None if failed
+    """
+    if _genai_client is None:
+        logger.error("Error querying Gemini model %s: GOOGLE_API_KEY is not set", model_name)
+        return None
+
+    try:
+        contents, config = _build_gemini_sdk_request(messages, timeout)
+        response = await _genai_client.aio.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=config
+        )
+        if response.text is None:
+            return None
+        return {
+            'content': response.text,
+            'reasoning_details': None
         }
-    
-    # Use API key from config
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={GOOGLE_API_KEY}"
-    
+    except Exception as e:
+        logger.error("Error querying Gemini model %s: %s", model_name, e)
+        return None
+
+
+async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[Dict[str, Any]]:
+    """Yield the JSON payload of each `data:` frame in an SSE response."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            return
+        yield orjson.loads(data)
+
+
+async def query_openai_stream(model_name: str, messages: List[Dict[str, Any]], timeout: float = 120.0) -> AsyncIterator[str]:
+    """
+    Stream a completion from the OpenAI API.
+
+    Yields:
+        Text deltas as they arrive
+    """
+    payload = {
+        "model": model_name,
+        "messages": _to_openai_messages(messages),
+        "stream": True,
+    }
+
+    async with _openai_client.stream(
+        "POST",
+        "/v1/chat/completions",
+        content=orjson.dumps(payload),
+        timeout=httpx.Timeout(timeout, connect=10.0)
+    ) as response:
+        response.raise_for_status()
+        async for chunk in _iter_sse_data(response):
+            if not chunk.get('choices'):
+                continue
+            delta = chunk['choices'][0].get('delta', {}).get('content')
+            if delta:
+                yield delta
+
+
+async def query_gemini_stream(model_name: str, messages: List[Dict[str, Any]], timeout: float = 120.0) -> AsyncIterator[str]:
+    """
+    Stream a completion from the Gemini API.
+
+    Yields:
+        Text deltas as they arrive
+    """
+    if _genai_client is None:
+        raise RuntimeError("GOOGLE_API_KEY is not set")
+
+    contents, config = _build_gemini_sdk_request(messages, timeout)
+    stream = await _genai_client.aio.models.generate_content_stream(
+        model=model_name,
+        contents=contents,
+        config=config
+    )
+    async for chunk in stream:
+        if chunk.text:
+            yield chunk.text
+
+
+async def _collect_stream(
+    model: str,
+    stream: AsyncIterator[str],
+    on_delta: Callable[[str], None],
+    fallback: Optional[Callable[[], Awaitable[Optional[Dict[str, Any]]]]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Drain a delta stream, forwarding each delta, and return the full response.
+
+    If the provider refuses the streaming request itself (a 4xx other than
+    a rate limit, e.g. OpenAI models that need a verified organisation to
+    stream), `fallback` is awaited once instead and its content is passed
+    to `on_delta` in one piece.
+    """
+    parts = []
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(
-                url,
-                headers={"Content-Type": "application/json"},
-                json=payload
-            )
-            response.raise_for_status()
-            
-            data = response.json()
-            
-            # Extract text from Gemini response
-            if 'candidates' in data and len(data['candidates']) > 0:
-                candidate = data['candidates'][0]
-                if 'content' in candidate and 'parts' in candidate['content']:
-                    text_parts = [part.get('text', '') for part in candidate['content']['parts']]
-                    return {
-                        'content': ''.join(text_parts),
-                        'reasoning_details': None
-                    }
-            
+        async for delta in stream:
+            parts.append(delta)
+            on_delta(delta)
+    except httpx.HTTPStatusError as e:
+        status = e.response.status_code
+        if fallback is None or parts or not 400 <= status < 500 or status == 429:
+            logger.error("Error streaming model %s: %s", model, e)
             return None
-    
+        logger.warning("Streaming %s was rejected (%s); retrying without streaming", model, status)
+        response = await fallback()
+        if response is not None and response.get('content'):
+            on_delta(response['content'])
+        return response
     except Exception as e:
-        print(f"Error querying Gemini model {model_name}: {e}")
+        logger.error("Error streaming model %s: %s", model, e)
         return None
 
+    return {
+        'content': ''.join(parts),
+        'reasoning_details': None
+    }
+
 
+@cached_call
 async def query_model(
     model: str,
     messages: List[Dict[str, Any]],
-    timeout: float = 120.0
+    timeout: float = 120.0,
+    on_delta: Optional[Callable[[str], None]] = None
 ) -> Optional[Dict[str, Any]]:
     """
     Query a model via the appropriate API based on provider prefix.
+
+    Identical (model, messages) requests are served from the response cache.
+    When `on_delta` is given the response is streamed and each text delta is
+    passed to it as it arrives; the return value is the same either way.
+    """
+    return await query_model_uncached(model, messages, timeout, on_delta)
+
+
+async def query_model_uncached(
+    model: str,
+    messages: List[Dict[str, Any]],
+    timeout: float = 120.0,
+    on_delta: Optional[Callable[[str], None]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Query a model like query_model, bypassing the response cache.
+
+    For repeated council seats: the cache (and its single-flight) would
+    collapse them into copies of one answer instead of independent samples.
     """
     if model.startswith("openai/"):
         model_name = model.replace("openai/", "")
+        if on_delta:
+            return await _collect_stream(
+                model, query_openai_stream(model_name, messages, timeout), on_delta,
+                fallback=functools.partial(query_openai, model_name, messages, timeout)
+            )
         return await query_openai(model_name, messages, timeout)
     elif model.startswith("google/"):
         model_name = model.replace("google/", "")
+        if on_delta:
+            return await _collect_stream(model, query_gemini_stream(model_name, messages, timeout), on_delta)
         return await query_gemini(model_name, messages, timeout)
     else:
-        print(f"Unknown provider for model: {model}")
+        logger.error("Unknown provider for model: %s", model)
         return None
 
 
-async def query_models_parallel(
+async def iter_models_firstN(
+    models: List[str],
+    messages: List[Dict[str, Any]],
+    min_responses: int = 1,
+    grace_ms: int = 2000,
+    first_token_ms: int = 60000,
+    on_delta: Optional[Callable[[str, str], None]] = None
+) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
+    """
+    Query multiple models in parallel, yielding (model, response) as each finishes.
+
+    Once `min_responses` models have answered successfully, the rest are
+    checked for stalls: a model that has streamed nothing yet gets
+    `first_token_ms` milliseconds (reasoning models stay silent while they
+    think), and one that has started streaming is stalled after `grace_ms`
+    milliseconds without a delta. Stalled models are cancelled and not
+    yielded; slow ones still producing tokens are waited for. Failed models
+    are yielded with None.
+    """
+    loop = asyncio.get_running_loop()
+    last_delta: List[Optional[float]] = [None] * len(models)
+
+    def relay(index: int, model: str, delta: str):
+        last_delta[index] = loop.time()
+        if on_delta:
+            on_delta(model, delta)
+
+    # Always stream, so there is activity to tell a stall from a slow answer.
+    # Repeated seats skip the cache so each gets its own sample.
+    seats = Counter(models)
+    tasks = {
+        asyncio.create_task(
+            (query_model_uncached if seats[model] > 1 else query_model)(
+                model, messages, on_delta=functools.partial(relay, index, model)
+            )
+        ): index
+        for index, model in enumerate(models)
+    }
+    pending = set(tasks)
+    succeeded = 0
+    grace = grace_ms / 1000
+    first_token = first_token_ms / 1000
+    grace_started = None
+
+    def deadline(task: asyncio.Task) -> float:
+        last = last_delta[tasks[task]]
+        if last is None:
+            return grace_started + first_token
+        return max(grace_started, last) + grace
+
+    try:
+        while pending:
+            timeout = None
+            if grace_started is not None:
+                timeout = max(0.0, min(deadline(task) for task in pending) - loop.time())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                response = task.result()
+                if response is not None:
+                    succeeded += 1
+                else:
+                    logger.warning("Council seat %d (%s) returned no response", tasks[task] + 1, models[tasks[task]])
+                yield models[tasks[task]], response
+
+            if grace_started is None:
+                if succeeded >= min_responses:
+                    grace_started = loop.time()
+                continue
+
+            now = loop.time()
+            stalled = {task for task in pending if deadline(task) <= now}
+            for task in stalled:
+                task.cancel()
+                if last_delta[tasks[task]] is None:
+                    logger.warning("Cancelled model %s after %sms without a first token", models[tasks[task]], first_token_ms)
+                else:
+                    logger.warning("Cancelled model %s after %sms without output", models[tasks[task]], grace_ms)
+            pending -= stalled
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def iter_models_batched(
     models: List[str],
     messages: List[Dict[str, Any]]
-) -> Dict[str, Optional[Dict[str, Any]]]:
+) -> AsyncIterator[Tuple[str, Optional[Dict[str, Any]]]]:
     """
-    Query multiple models in parallel.
+    Query models in parallel, yielding (model, response) pairs as they finish.
+
+    Repeated entries are kept: a model listed several times gets that many
+    independent samples (uncached). For OpenAI
+    these share a single request with `n` completions.
     """
-    import asyncio
-    
-    # Create tasks for all models
-    tasks = [query_model(model, messages) for model in models]
-    
-    # Wait for all to complete
-    responses = await asyncio.gather(*tasks)
-    
-    # Map models to their responses
-    return {model: response for model, response in zip(models, responses)}
+    async def query_group(model: str, count: int) -> List[Tuple[str, Optional[Dict[str, Any]]]]:
+        if count > 1 and model.startswith("openai/"):
+            choices = await query_openai_choices(model.replace("openai/", ""), messages, count)
+            return [(model, choice) for choice in choices] or [(model, None)]
+        query = query_model_uncached if count > 1 else query_model
+        responses = await asyncio.gather(*[query(model, messages) for _ in range(count)])
+        return [(model, response) for response in responses]
+
+    tasks = [
+        asyncio.create_task(query_group(model, count))
+        for model, count in Counter(models).items()
+    ]
+    try:
+        for next_group in asyncio.as_completed(tasks):
+            for pair in await next_group:
+                yield pair
+    finally:
+        for task in tasks:
+            task.cancel()
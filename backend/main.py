@@ -1,27 +1,167 @@
 """FastAPI backend for LLM Council."""
 
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any, Optional
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse
+try:
+    from fastapi.sse import EventSourceResponse, ServerSentEvent
+except ImportError:  # FastAPI without native SSE support
+    EventSourceResponse = ServerSentEvent = None
+from pydantic import BaseModel, ValidationError
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator, Callable
+from typing_extensions import TypedDict
+from contextlib import asynccontextmanager
 import uuid
-import json
+import anyio
+import orjson
 import asyncio
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 import supabase_storage as storage
-from council import run_full_council, generate_conversation_title
+import semantic_cache
+import llm_client
+from council import (
+    run_full_council,
+    generate_conversation_title,
+    build_chat_history,
+    stage1_stream,
+    stage2_stream,
+    stage3_synthesize_final,
+    anonymize_responses,
+    calculate_aggregate_rankings,
+    in_council_order,
+    warm_tokenizer,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _start_logging() -> Tuple[QueueHandler, QueueListener]:
+    """
+    Send log records through a queue to a background thread.
+
+    Handlers write to stderr off the event loop, so a burst of provider
+    errors never blocks request coroutines on console I/O.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    queue_handler = QueueHandler(log_queue)
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+    # httpx/httpcore log every outbound request at INFO; keep only their warnings
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    return queue_handler, listener
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup/shutdown hooks."""
+    queue_handler, log_listener = _start_logging()
+    warm_tokenizer()
+    # Preheat the embedding model in the background without delaying startup
+    warmup = asyncio.create_task(semantic_cache.warm())
+    try:
+        yield
+    finally:
+        # Each teardown step runs even if an earlier one raises, so a failed
+        # client close never costs the semantic cache snapshot
+        warmup.cancel()
+        try:
+            await llm_client.aclose()
+        finally:
+            try:
+                await storage.aclose()
+            finally:
+                try:
+                    semantic_cache.snapshot()
+                finally:
+                    logging.getLogger().removeHandler(queue_handler)
+                    log_listener.stop()
+
+
+app = FastAPI(title="LLM Council API", lifespan=lifespan)
+
+class CORS:
+    """
+    Pure-ASGI CORS middleware.
+
+    Adds CORS headers to the response start message and answers preflight
+    requests directly, without building Starlette Request/Response objects.
+    The request origin is echoed back so credentials work with "*".
+    """
+
+    def __init__(self, app, origins: List[str]):
+        self.app = app
+        self.allow_all = "*" in origins
+        self.origins = frozenset(origin.encode("latin-1") for origin in origins)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        origin = headers.get(b"origin")
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+
+        allowed = self.allow_all or origin in self.origins
+
+        # Preflight: answer here instead of routing to the app
+        if scope["method"] == "OPTIONS" and b"access-control-request-method" in headers:
+            if not allowed:
+                await send({
+                    "type": "http.response.start",
+                    "status": 400,
+                    "headers": [(b"content-type", b"text/plain; charset=utf-8"), (b"vary", b"Origin")],
+                })
+                await send({"type": "http.response.body", "body": b"Disallowed CORS origin"})
+                return
+
+            preflight_headers = [
+                (b"access-control-allow-origin", origin),
+                (b"access-control-allow-credentials", b"true"),
+                (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+                (b"access-control-max-age", b"600"),
+                (b"vary", b"Origin"),
+                (b"content-length", b"0"),
+            ]
+            requested_headers = headers.get(b"access-control-request-headers")
+            if requested_headers:
+                preflight_headers.append((b"access-control-allow-headers", requested_headers))
+            await send({"type": "http.response.start", "status": 200, "headers": preflight_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        if not allowed:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [
+                    *message.get("headers", ()),
+                    (b"access-control-allow-origin", origin),
+                    (b"access-control-allow-credentials", b"true"),
+                    (b"vary", b"Origin"),
+                ]
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
 
-app = FastAPI(title="LLM Council API")
 
 # Enable CORS for local development and external access
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow all origins for now - restrict in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+app.add_middleware(CORS, origins=["*"])  # Allow all origins for now - restrict in production
 
 
 class CreateConversationRequest(BaseModel):
@@ -29,8 +169,14 @@ class CreateConversationRequest(BaseModel):
     user_id: str = "default"
 
 
-class Attachment(BaseModel):
-    """File attachment model."""
+class Attachment(TypedDict):
+    """
+    File attachment.
+
+    A TypedDict rather than a model: pydantic validates the fields but
+    hands the council and storage plain dicts, with no model objects or
+    .dict() copies of the base64 payload.
+    """
     name: str
     type: str  # 'image', 'document'
     mimeType: str
@@ -44,6 +190,31 @@ class SendMessageRequest(BaseModel):
     attachments: List[Attachment] = []
 
 
+async def parse_send_message(request: Request) -> SendMessageRequest:
+    """
+    Parse and validate a SendMessageRequest body in a worker thread.
+
+    Bodies can carry several MB of base64 attachments; decoding and
+    validating them on the event loop would stall every other request.
+    """
+    body = await request.body()
+    try:
+        return await anyio.to_thread.run_sync(SendMessageRequest.model_validate_json, body)
+    except ValidationError as e:
+        # Same error shape FastAPI produces for regular body parameters
+        errors = [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)]
+        raise RequestValidationError(errors, body=body)
+
+
+# parse_send_message bypasses FastAPI's body handling, so document it here
+_SEND_MESSAGE_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": SendMessageRequest.model_json_schema()}},
+    }
+}
+
+
 class ConversationMetadata(BaseModel):
     """Conversation metadata for list view."""
     id: str
@@ -67,82 +238,112 @@ async def root():
     return {"status": "ok", "service": "LLM Council API"}
 
 
-@app.get("/api/conversations", response_model=List[ConversationMetadata])
-async def list_conversations(user_id: str = None):
-    """List conversations (metadata only), optionally filtered by user_id."""
-    return storage.list_conversations(user_id)
+@app.get("/api/conversations", response_class=Response, responses={200: {"model": List[ConversationMetadata]}})
+async def list_conversations(
+    user_id: str = None,
+    limit: Optional[int] = Query(None, ge=1, le=200),
+    offset: int = Query(0, ge=0)
+):
+    """
+    List conversations (metadata only), newest first, optionally filtered by user_id.
+
+    Unpaged unless the client passes `limit` (and `offset` for later pages).
+    """
+    conversations = await storage.list_conversations(user_id, limit=limit, offset=offset)
+    # Rows come straight from the conversations_meta view; skip re-validation
+    return Response(orjson.dumps(conversations), media_type="application/json")
 
 
 @app.post("/api/conversations", response_model=Conversation)
 async def create_conversation(request: CreateConversationRequest):
     """Create a new conversation."""
     conversation_id = str(uuid.uuid4())
-    conversation = storage.create_conversation(conversation_id, request.user_id)
+    conversation = await storage.create_conversation(conversation_id, request.user_id)
     return conversation
 
 
 @app.delete("/api/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str):
     """Delete a conversation."""
-    deleted = storage.delete_conversation(conversation_id)
+    deleted = await storage.delete_conversation(conversation_id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return {"message": "Conversation deleted"}
 
 
-@app.get("/api/conversations/{conversation_id}", response_model=Conversation)
+@app.get("/api/conversations/{conversation_id}", response_class=Response, responses={200: {"model": Conversation}})
 async def get_conversation(conversation_id: str):
     """Get a specific conversation with all its messages."""
-    conversation = storage.get_conversation(conversation_id)
+    conversation = await storage.get_conversation(conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    return conversation
+    # Stored rows already have this shape; skip re-validating every message
+    return Response(orjson.dumps(conversation), media_type="application/json")
 
 
-@app.post("/api/conversations/{conversation_id}/message")
-async def send_message(conversation_id: str, request: SendMessageRequest):
+@app.post("/api/conversations/{conversation_id}/message", openapi_extra=_SEND_MESSAGE_BODY)
+async def send_message(
+    conversation_id: str,
+    request: SendMessageRequest = Depends(parse_send_message)
+):
     """
     Send a message and run the 3-stage council process.
     Returns the complete response with all stages.
     """
     # Check if conversation exists and get history
-    conversation = storage.get_conversation(conversation_id)
+    conversation = await storage.get_conversation(conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     history = conversation.get("messages", [])
     is_first_message = len(history) == 0
 
-    # Add user message to storage
-    # Convert Pydantic models to dicts
-    attachments_dict = [att.dict() for att in request.attachments] if request.attachments else None
-    storage.add_user_message(conversation_id, request.content, attachments_dict)
+    attachments_dict = request.attachments or None
+
+    # The user message is saved together with the answer in finalize_turn
+    user_message = storage.build_user_message(request.content, attachments_dict)
 
-    # If this is the first message, generate a title
+    # If this is the first message, generate a title in parallel with the council
+    title_task = None
     if is_first_message:
         # We can extract text from attachments if content is empty (e.g. just sending a PDF)
         # But generate_conversation_title expects string.
         title_content = request.content
         if not title_content and request.attachments:
-            title_content = f"Analysis of {request.attachments[0].name}"
-            
-        title = await generate_conversation_title(title_content)
-        storage.update_conversation_title(conversation_id, title)
-
-    # Run the 3-stage council process
-    stage1_results, stage2_results, stage3_result, metadata = await run_full_council(
-        request.content,
-        history,
-        attachments_dict
-    )
-
-    # Add assistant message with all stages
-    storage.add_assistant_message(
-        conversation_id,
-        stage1_results,
-        stage2_results,
-        stage3_result
-    )
+            title_content = f"Analysis of {request.attachments[0].get('name', 'file')}"
+        title_task = asyncio.create_task(generate_conversation_title(title_content))
+
+    try:
+        # Run the 3-stage council process
+        stage1_results, stage2_results, stage3_result, metadata = await run_full_council(
+            request.content,
+            history,
+            attachments_dict
+        )
+    except BaseException:
+        if title_task:
+            title_task.cancel()
+        await save_user_message_fallback(conversation_id, user_message)
+        raise
+
+    title = None
+    if title_task:
+        try:
+            title = await title_task
+        except Exception as e:
+            logger.error("Title generation failed: %s", e)
+
+    # Save both messages (and the title) in one round trip
+    try:
+        await storage.finalize_turn(
+            conversation_id,
+            user_message,
+            storage.build_assistant_message(stage1_results, stage2_results, stage3_result),
+            title
+        )
+    except Exception:
+        await save_user_message_fallback(conversation_id, user_message)
+        raise
 
     # Return the complete response with metadata
     return {
@@ -153,99 +354,259 @@ async def send_message(conversation_id: str, request: SendMessageRequest):
     }
 
 
-@app.post("/api/conversations/{conversation_id}/message/stream")
-async def send_message_stream(conversation_id: str, request: SendMessageRequest):
-    """
-    Send a message and stream the 3-stage council process.
-    Returns Server-Sent Events as each stage completes.
-    """
-    # Check if conversation exists and get history
-    conversation = storage.get_conversation(conversation_id)
+async def existing_conversation(conversation_id: str) -> Dict[str, Any]:
+    """Load the conversation, or respond 404 before any streaming starts."""
+    conversation = await storage.get_conversation(conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
+    return conversation
 
+
+async def council_events(
+    conversation_id: str,
+    request: SendMessageRequest,
+    conversation: Dict[str, Any]
+) -> AsyncIterator[Dict[str, Any]]:
+    """Run the 3-stage council for a message, yielding progress events."""
     history = conversation.get("messages", [])
     is_first_message = len(history) == 0
-    
-    # Convert Pydantic models to dicts
-    attachments_dict = [att.dict() for att in request.attachments] if request.attachments else None
-
-    async def event_generator():
+    attachments_dict = request.attachments or None
+
+    # The user message is saved together with the answer in finalize_turn
+    user_message = storage.build_user_message(request.content, attachments_dict)
+    saved = False
+    title_task = None
+
+    # Every task this turn starts; all are cancelled on the way out so an
+    # error or client disconnect never leaves paid LLM calls running.
+    # (asyncio.TaskGroup needs Python 3.11, and its cancel scope can't span
+    # the yields of this generator anyway.)
+    tasks = set()
+
+    def spawn(coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        return task
+
+    try:
+        # Start title generation in parallel (don't await yet)
+        if is_first_message:
+            title_content = request.content
+            if not title_content and request.attachments:
+                title_content = f"Analysis of {request.attachments[0].get('name', 'file')}"
+            title_task = spawn(generate_conversation_title(title_content))
+
+        # Stage 1: Relay tokens as they stream in and each response as it completes
+        yield {'type': 'stage1_start'}
+        processed_history = await build_chat_history(history)
+        events = asyncio.Queue()
+        stage1_task = spawn(collect_stream(
+            stage1_stream(
+                request.content, processed_history, attachments_dict,
+                on_delta=token_relay(events, 'stage1_token')
+            ),
+            events, 'stage1_partial'
+        ))
+        async for event in relay_events(stage1_task, events):
+            yield event
+        stage1_results = in_council_order(await stage1_task)
+        yield {'type': 'stage1_complete', 'data': stage1_results}
+
+        # Stage 2: Relay each ranking as it completes
+        label_to_model = anonymize_responses(stage1_results)
+        yield {'type': 'stage2_start', 'metadata': {'label_to_model': label_to_model}}
+
+        history_ctx = f"Previous messages: {len(history)}" if history else ""
+        events = asyncio.Queue()
+        stage2_task = spawn(collect_stream(
+            stage2_stream(request.content, stage1_results, history_ctx),
+            events, 'stage2_partial'
+        ))
+        async for event in relay_events(stage2_task, events):
+            yield event
+        stage2_results = in_council_order(await stage2_task)
+        aggregate_rankings = calculate_aggregate_rankings(stage2_results, label_to_model)
+
+        yield {'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings}}
+
+        # Stage 3: Synthesize final answer
+        yield {'type': 'stage3_start'}
+        events = asyncio.Queue()
+        stage3_task = spawn(stage3_synthesize_final(
+            request.content, stage1_results, stage2_results, processed_history,
+            on_delta=token_relay(events, 'stage3_token')
+        ))
+        async for event in relay_events(stage3_task, events):
+            yield event
+        stage3_result = await stage3_task
+        yield {'type': 'stage3_complete', 'data': stage3_result}
+
+        # Wait for title generation if it was started
+        title = None
+        if title_task:
+            try:
+                title = await title_task
+            except Exception as e:
+                logger.error("Title generation failed: %s", e)
+
+        # Save both messages (and the title) in one round trip. Shielded so a
+        # disconnect from here on still persists the finished turn; a failed
+        # save falls back to keeping just the question.
+        finalize = asyncio.ensure_future(storage.finalize_turn(
+            conversation_id,
+            user_message,
+            storage.build_assistant_message(stage1_results, stage2_results, stage3_result),
+            title
+        ))
         try:
-            # Add user message
-            storage.add_user_message(conversation_id, request.content, attachments_dict)
-
-            # Start title generation in parallel (don't await yet)
-            title_task = None
-            if is_first_message:
-                title_content = request.content
-                if not title_content and request.attachments:
-                    title_content = f"Analysis of {request.attachments[0].name}"
-                title_task = asyncio.create_task(generate_conversation_title(title_content))
-
-            # Stage 1: Collect responses
-            yield f"data: {json.dumps({'type': 'stage1_start'})}\n\n"
-            stage1_results = await call_stage1_wrapper(request.content, history, attachments_dict)
-            yield f"data: {json.dumps({'type': 'stage1_complete', 'data': stage1_results})}\n\n"
-
-            # Stage 2: Collect rankings
-            yield f"data: {json.dumps({'type': 'stage2_start'})}\n\n"
-            # Import here to avoid circular dependencies if any (none expected but safer)
-            from council import stage2_collect_rankings, calculate_aggregate_rankings
-            
-            history_ctx = f"Previous messages: {len(history)}" if history else ""
-            stage2_results, label_to_model = await stage2_collect_rankings(request.content, stage1_results, history_ctx)
-            aggregate_rankings = calculate_aggregate_rankings(stage2_results, label_to_model)
-            
-            yield f"data: {json.dumps({'type': 'stage2_complete', 'data': stage2_results, 'metadata': {'label_to_model': label_to_model, 'aggregate_rankings': aggregate_rankings}})}\n\n"
-
-            # Stage 3: Synthesize final answer
-            yield f"data: {json.dumps({'type': 'stage3_start'})}\n\n"
-            from council import stage3_synthesize_final
-            stage3_result = await stage3_synthesize_final(request.content, stage1_results, stage2_results, history)
-            yield f"data: {json.dumps({'type': 'stage3_complete', 'data': stage3_result})}\n\n"
-
-            # Wait for title generation if it was started
-            if title_task:
-                try:
-                    title = await title_task
-                    storage.update_conversation_title(conversation_id, title)
-                    yield f"data: {json.dumps({'type': 'title_complete', 'data': {'title': title}})}\n\n"
-                except Exception as e:
-                    print(f"Title generation failed: {e}")
-
-            # Save complete assistant message
-            storage.add_assistant_message(
-                conversation_id,
-                stage1_results,
-                stage2_results,
-                stage3_result
-            )
-
-            # Send completion event
-            yield f"data: {json.dumps({'type': 'complete'})}\n\n"
+            await asyncio.shield(finalize)
+        except asyncio.CancelledError:
+            # The shielded save is still running and will write the turn
+            saved = True
+            raise
+        saved = True
+
+        if title:
+            yield {'type': 'title_complete', 'data': {'title': title}}
+
+        # Send completion event
+        yield {'type': 'complete'}
+
+    except asyncio.CancelledError:
+        # Client disconnected; let the cancellation propagate
+        raise
+
+    except Exception as e:
+        logger.exception("Council stream failed")
+        # Send error event
+        yield {'type': 'error', 'message': str(e)}
+
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Council failed or the client disconnected: keep the question
+        if not saved:
+            await save_user_message_fallback(conversation_id, user_message)
 
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            # Send error event
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-        }
-    )
 
-# Wrapper to avoid async issues with direct import in generator
-async def call_stage1_wrapper(content, history, attachments):
-    from council import stage1_collect_responses
-    return await stage1_collect_responses(content, history, attachments)
+# Proxies and CDNs hold back the first few KB of a response; an SSE comment
+# this size pushes stage1_start through them as soon as it is sent
+_SSE_PADDING_BYTES = 2048
+
+# Keep compressing layers from buffering the stream to gzip it
+_SSE_HEADERS = {"Content-Encoding": "identity"}
+
+
+def sse_headers(response: Response):
+    """Add _SSE_HEADERS to the stream; FastAPI merges them with its own SSE headers."""
+    response.headers.update(_SSE_HEADERS)
+
+
+if EventSourceResponse is not None:
+    @app.post(
+        "/api/conversations/{conversation_id}/message/stream",
+        response_class=EventSourceResponse,
+        dependencies=[Depends(sse_headers)],
+        openapi_extra=_SEND_MESSAGE_BODY
+    )
+    async def send_message_stream(
+        conversation_id: str,
+        request: SendMessageRequest = Depends(parse_send_message),
+        conversation: Dict[str, Any] = Depends(existing_conversation)
+    ):
+        """
+        Send a message and stream the 3-stage council process.
+        Returns Server-Sent Events as each stage completes.
+        """
+        yield ServerSentEvent(comment=" " * _SSE_PADDING_BYTES)
+        # FastAPI frames each event and sends keep-alive pings between them
+        async for event in council_events(conversation_id, request, conversation):
+            yield ServerSentEvent(raw_data=orjson.dumps(event).decode(), event=event['type'])
+else:
+    @app.post("/api/conversations/{conversation_id}/message/stream", openapi_extra=_SEND_MESSAGE_BODY)
+    async def send_message_stream(
+        conversation_id: str,
+        request: SendMessageRequest = Depends(parse_send_message),
+        conversation: Dict[str, Any] = Depends(existing_conversation)
+    ):
+        """
+        Send a message and stream the 3-stage council process.
+        Returns Server-Sent Events as each stage completes.
+        """
+        return StreamingResponse(
+            _sse_stream(council_events(conversation_id, request, conversation)),
+            media_type="text/event-stream",
+            headers={
+                "Cache-Control": "no-cache",
+                "Connection": "keep-alive",
+                "X-Accel-Buffering": "no",
+                **_SSE_HEADERS,
+            }
+        )
+
+
+async def save_user_message_fallback(conversation_id: str, user_message: Dict[str, Any]):
+    """Persist just the user message when a turn ends without an answer."""
+    try:
+        # Shielded so a client disconnect can't cancel the write midway
+        await asyncio.shield(storage.append_message(conversation_id, user_message))
+    except Exception as e:
+        logger.error("Saving user message failed: %s", e)
+
+
+def _sse(event: Dict[str, Any]) -> bytes:
+    """Encode one Server-Sent Events frame."""
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+
+async def _sse_stream(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """Frame council events as SSE, led by the padding comment."""
+    yield b": " + b" " * _SSE_PADDING_BYTES + b"\n\n"
+    async for event in events:
+        yield _sse(event)
+
+
+def token_relay(events: asyncio.Queue, event_type: str) -> Callable[[str, str], None]:
+    """Build an on_delta callback that queues each (model, delta) as an event."""
+    return lambda model, delta: events.put_nowait({'type': event_type, 'model': model, 'delta': delta})
+
+
+async def collect_stream(
+    stream: AsyncIterator[Dict[str, Any]],
+    events: asyncio.Queue,
+    event_type: str
+) -> List[Dict[str, Any]]:
+    """Queue an event for each item of a stage stream; return all the items."""
+    items = []
+    async for item in stream:
+        items.append(item)
+        events.put_nowait({'type': event_type, 'data': item})
+    return items
+
+
+async def relay_events(task: asyncio.Task, events: asyncio.Queue):
+    """Yield each queued event until the task finishes."""
+    task.add_done_callback(lambda _: events.put_nowait(None))
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        yield event
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    from config import WEB_CONCURRENCY
+
+    # uvloop/httptools are picked automatically when installed (not on Windows).
+    # Single worker by default; see WEB_CONCURRENCY in config.py
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8001,
+        loop="auto",
+        http="auto",
+        workers=WEB_CONCURRENCY,
+        log_level="warning",
+        access_log=False,
+    )
@@ -0,0 +1,243 @@
+"""Semantic (embedding) cache for Stage 1 council responses."""
+
+import asyncio
+import importlib.util
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+try:
+    import faiss
+    import numpy as np
+except ImportError:
+    faiss = None
+
+from config import (
+    SEMANTIC_CACHE_ENABLED,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_MODEL,
+    SEMANTIC_CACHE_DIR,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# sentence-transformers pulls in torch, so only check it's installed here
+# and import it on first use
+_AVAILABLE = faiss is not None and importlib.util.find_spec("sentence_transformers") is not None
+
+# Roughly one encoder window (256 word pieces) of English text
+_CHUNK_CHARS = 1000
+# Chunks embedded per document in the similarity check. Keeps its CPU cost
+# bounded, and pooling fewer chunks keeps long answers on the same topic
+# from averaging out to the same vector.
+_MAX_CHUNKS = 4
+
+
+_embedder_model = None
+_embedder_failed = False
+_embedder_lock = threading.Lock()
+
+
+def _embedder():
+    """
+    Load the shared sentence-transformer (once per process).
+
+    Used by both the Stage 1 cache and the Stage 2 similarity check. If the
+    model can't be loaded (e.g. the hub is unreachable) the failure is
+    logged once and the encoder stays disabled for the rest of the process,
+    rather than every turn retrying and waiting out the hub timeout.
+    """
+    global _embedder_model, _embedder_failed
+    with _embedder_lock:
+        if _embedder_model is None:
+            if _embedder_failed:
+                raise RuntimeError("Sentence-transformer is unavailable")
+            try:
+                from sentence_transformers import SentenceTransformer
+                model = SentenceTransformer(SEMANTIC_CACHE_MODEL)
+            except Exception:
+                _embedder_failed = True
+                logger.exception("Loading %s failed; semantic features disabled", SEMANTIC_CACHE_MODEL)
+                raise
+            model.max_seq_length = 256
+            _embedder_model = model
+        return _embedder_model
+
+
+def _enabled() -> bool:
+    return _cache is not None and not _embedder_failed
+
+
+def _embed_documents(texts: List[str]):
+    """
+    Embed documents beyond their first few hundred tokens.
+
+    Each text is split into up to _MAX_CHUNKS chunks that fit the encoder
+    window; the chunk embeddings are mean-pooled and re-normalized. Does not
+    touch the cache index, so it runs without the cache lock.
+    """
+    vectors = []
+    for text in texts:
+        chunks = [
+            text[i:i + _CHUNK_CHARS]
+            for i in range(0, min(len(text), _CHUNK_CHARS * _MAX_CHUNKS), _CHUNK_CHARS)
+        ] or [""]
+        pooled = _embedder().encode(chunks, normalize_embeddings=True).mean(axis=0)
+        vectors.append(pooled / (np.linalg.norm(pooled) or 1.0))
+    return np.asarray(vectors, dtype="float32")
+
+
+class SemanticCache:
+    """
+    Reuse Stage 1 results for paraphrased questions.
+
+    Query -> embedding -> FAISS top-1 search -> threshold -> hit/miss.
+    The index lives in memory and is snapshotted to disk on shutdown;
+    the cached results are stored in SQLite keyed by vector id.
+    """
+
+    def __init__(self, directory: str, threshold: float):
+        self.directory = Path(directory)
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._index = None
+        self._db = None
+
+    def _ensure_loaded(self):
+        if self._index is not None:
+            return
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        dim = _embedder().get_sentence_embedding_dimension()
+
+        index_path = self.directory / "index.faiss"
+        index = faiss.read_index(str(index_path)) if index_path.exists() else faiss.IndexFlatIP(dim)
+
+        db = sqlite3.connect(self.directory / "entries.db", check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY, models TEXT, query TEXT, results TEXT)"
+        )
+        # Rows added after the last snapshot have no vector; drop them
+        db.execute("DELETE FROM entries WHERE id >= ?", (index.ntotal,))
+        db.commit()
+
+        self._index, self._db = index, db
+
+    def warm_sync(self):
+        with self._lock:
+            self._ensure_loaded()
+
+    def _embed(self, text: str):
+        vector = _embedder().encode([text], normalize_embeddings=True)
+        return np.asarray(vector, dtype="float32")
+
+    @staticmethod
+    def _fits_window(query: str) -> bool:
+        """
+        Whether the encoder sees all of `query`.
+
+        Longer queries are truncated before embedding, so two that differ
+        only past the window would look identical; those aren't cached.
+        """
+        model = _embedder()
+        return len(model.tokenizer(query)["input_ids"]) <= model.max_seq_length
+
+    def lookup_sync(self, query: str, models: List[str]) -> Optional[List[Dict[str, Any]]]:
+        if not self._fits_window(query):
+            return None
+        with self._lock:
+            self._ensure_loaded()
+            if self._index.ntotal == 0:
+                return None
+
+            scores, ids = self._index.search(self._embed(query), 1)
+            if scores[0][0] < self.threshold:
+                return None
+
+            row = self._db.execute(
+                "SELECT models, results FROM entries WHERE id = ?", (int(ids[0][0]),)
+            ).fetchone()
+
+        # A hit is only valid for the same council composition
+        if row is None or json.loads(row[0]) != models:
+            return None
+        return json.loads(row[1])
+
+    def add_sync(self, query: str, models: List[str], results: List[Dict[str, Any]]):
+        if not self._fits_window(query):
+            return
+        with self._lock:
+            self._ensure_loaded()
+            vector_id = self._index.ntotal
+            self._index.add(self._embed(query))
+            self._db.execute(
+                "INSERT INTO entries (id, models, query, results) VALUES (?, ?, ?, ?)",
+                (vector_id, json.dumps(models), query, json.dumps(results))
+            )
+            self._db.commit()
+
+    def snapshot(self):
+        with self._lock:
+            if self._index is not None:
+                faiss.write_index(self._index, str(self.directory / "index.faiss"))
+
+
+_cache = SemanticCache(SEMANTIC_CACHE_DIR, SEMANTIC_CACHE_THRESHOLD) if _AVAILABLE and SEMANTIC_CACHE_ENABLED else None
+
+
+async def warm():
+    """Load the embedding model (and the cache index) ahead of the first request."""
+    if not _AVAILABLE or _embedder_failed:
+        return
+    try:
+        await asyncio.to_thread(_cache.warm_sync if _cache is not None else _embedder)
+    except Exception as e:
+        logger.error("Semantic cache warm-up failed: %s", e)
+
+
+async def lookup(query: str, models: List[str]) -> Optional[List[Dict[str, Any]]]:
+    """Return cached Stage 1 results for a semantically similar query, if any."""
+    if not _enabled():
+        return None
+    try:
+        return await asyncio.to_thread(_cache.lookup_sync, query, models)
+    except Exception as e:
+        logger.error("Semantic cache lookup failed: %s", e)
+        return None
+
+
+async def store(query: str, models: List[str], results: List[Dict[str, Any]]):
+    """Remember Stage 1 results for a query."""
+    if not _enabled():
+        return
+    try:
+        await asyncio.to_thread(_cache.add_sync, query, models, results)
+    except Exception as e:
+        logger.error("Semantic cache write failed: %s", e)
+
+
+async def min_pairwise_similarity(texts: List[str]) -> Optional[float]:
+    """
+    Lowest cosine similarity between any two of `texts`.
+
+    Works whenever the encoder is installed, even with the Stage 1 cache
+    turned off. Returns None when the encoder is unavailable.
+    """
+    if not _AVAILABLE or _embedder_failed or len(texts) < 2:
+        return None
+    try:
+        vectors = await asyncio.to_thread(_embed_documents, texts)
+    except Exception as e:
+        logger.error("Similarity check failed: %s", e)
+        return None
+    return float((vectors @ vectors.T).min())
+
+
+def snapshot():
+    """Persist the in-memory index to disk."""
+    if _cache is not None:
+        _cache.snapshot()
@@ -1,22 +1,193 @@
 """Supabase-based storage for conversations."""
 
+import asyncio
+import base64
+import binascii
+import contextlib
 import httpx
+import logging
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from types import MappingProxyType
+from typing import List, Dict, Any, Optional, Tuple
+import zstandard
+from cachetools import TTLCache
 from config import SUPABASE_URL, SUPABASE_KEY
 
+logger = logging.getLogger(__name__)
 
-def _get_headers():
-    """Get headers for Supabase API requests."""
+
+def _get_headers(prefer: str = "minimal"):
+    """
+    Get headers for Supabase API requests.
+
+    Writes default to return=minimal so PostgREST doesn't echo the whole row
+    (including every message) back; pass "representation" when it's needed.
+    """
     return {
         "apikey": SUPABASE_KEY,
         "Authorization": f"Bearer {SUPABASE_KEY}",
         "Content-Type": "application/json",
-        "Prefer": "return=representation"
+        "Prefer": f"return={prefer}"
     }
 
 
-def create_conversation(conversation_id: str, user_id: str = "default") -> Dict[str, Any]:
+_HEADERS = MappingProxyType(_get_headers())
+_RETURN_REPRESENTATION = MappingProxyType({"Prefer": "return=representation"})
+
+# PostgREST endpoints; filters are passed as params so httpx encodes them
+_CONVERSATIONS = "/rest/v1/conversations"
+_CONVERSATIONS_META = "/rest/v1/conversations_meta"
+_RPC_APPEND_MESSAGE = "/rest/v1/rpc/append_message"
+_RPC_FINALIZE_TURN = "/rest/v1/rpc/finalize_turn"
+
+# Columns of a conversation read; the API returns the row as-is, so this
+# keeps user_id (and any columns added later) out of responses
+_CONVERSATION_COLUMNS = "id,created_at,title,messages"
+
+# One pooled HTTP/2 client for all PostgREST calls, so requests reuse the
+# TLS connection instead of handshaking (and blocking the loop) every time
+_client = httpx.AsyncClient(
+    base_url=SUPABASE_URL,
+    headers=_HEADERS,
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=10.0),
+    limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60),
+)
+
+
+def _approx_size(conversation: Dict[str, Any]) -> int:
+    """Rough in-memory size of a conversation: the length of every string in it."""
+    size = 0
+    stack = [conversation]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, str):
+            size += len(value)
+        elif isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+    return size
+
+
+# Recently read conversations. Opening a conversation and then sending a
+# message to it, or several tabs/requests reading it at once, cost a single
+# round trip. Bounded by total size rather than count, since rows hold their
+# attachments decompressed; rows too large to be worth holding are not
+# cached. Writes through this module invalidate the entry.
+_CONVERSATION_CACHE_BYTES = 64 * 1024 * 1024
+_CONVERSATION_CACHE_MAX_ROW_BYTES = 4 * 1024 * 1024
+_conversation_cache = TTLCache(maxsize=_CONVERSATION_CACHE_BYTES, ttl=30, getsizeof=_approx_size)
+
+# Single-flight: concurrent reads of the same conversation share one request
+_inflight: Dict[str, asyncio.Future] = {}
+
+
+def _invalidate(conversation_id: str):
+    """Drop a conversation from the read cache."""
+    _conversation_cache.pop(conversation_id, None)
+    # A read already in flight may predate the write; stop sharing it
+    _inflight.pop(conversation_id, None)
+
+
+@contextlib.contextmanager
+def _invalidating(conversation_id: str):
+    """
+    Invalidate a conversation around a write.
+
+    Once before the request, and again when it returns: a read that starts
+    while the write is in flight can still see the old row, and must not
+    stay cached (or shared) once the write has landed.
+    """
+    _invalidate(conversation_id)
+    try:
+        yield
+    finally:
+        _invalidate(conversation_id)
+
+
+# Attachments larger than this (base64 characters) are stored zstd-compressed
+_COMPRESS_MIN_CHARS = 32 * 1024
+_COMPRESSED_ENCODING = "zstd+b64"
+
+
+def _split_data_uri(data: str) -> Tuple[str, str]:
+    """Split "data:<mime>;base64,<payload>" into (header, payload); header may be empty."""
+    if data.startswith("data:"):
+        header, _, payload = data.partition(",")
+        return header + ",", payload
+    return "", data
+
+
+def _compress_attachment(attachment: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Return a zstd-compressed copy of a large attachment, or the attachment itself.
+
+    The payload is decoded, compressed and re-encoded as base64; any data-URI
+    header is kept in front of it so reads restore the original string.
+    """
+    data = attachment.get("data")
+    if (
+        attachment.get("type") not in ("image", "document")
+        or attachment.get("encoding")
+        or not isinstance(data, str)
+        or len(data) <= _COMPRESS_MIN_CHARS
+    ):
+        return attachment
+
+    header, payload = _split_data_uri(data)
+    try:
+        raw = base64.b64decode(payload)
+    except (binascii.Error, ValueError):
+        return attachment
+
+    compressed = base64.b64encode(zstandard.ZstdCompressor(level=3).compress(raw)).decode("ascii")
+    # Already-compressed formats (JPEG, PNG) don't shrink; keep those as-is
+    if len(compressed) >= len(payload):
+        return attachment
+    return {**attachment, "data": header + compressed, "encoding": _COMPRESSED_ENCODING}
+
+
+def _encode_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compress large attachments for storage without mutating the input."""
+    encoded = []
+    for message in messages:
+        attachments = message.get("attachments")
+        if attachments:
+            message = {**message, "attachments": [_compress_attachment(att) for att in attachments]}
+        encoded.append(message)
+    return encoded
+
+
+def _decode_messages(messages: List[Dict[str, Any]]):
+    """Restore compressed attachments (in place) to plain base64."""
+    decompressor = zstandard.ZstdDecompressor()
+    for message in messages:
+        for attachment in message.get("attachments") or ():
+            if attachment.get("encoding") == _COMPRESSED_ENCODING:
+                header, payload = _split_data_uri(attachment["data"])
+                raw = decompressor.decompress(base64.b64decode(payload))
+                attachment["data"] = header + base64.b64encode(raw).decode("ascii")
+                del attachment["encoding"]
+
+
+def _has_attachments(messages: List[Dict[str, Any]]) -> bool:
+    return any(message.get("attachments") for message in messages)
+
+
+async def _prepare_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compress attachments off the event loop (zstd releases the GIL)."""
+    if not _has_attachments(messages):
+        return messages
+    return await asyncio.to_thread(_encode_messages, messages)
+
+
+async def aclose():
+    """Close the shared HTTP client. Call once on application shutdown."""
+    await _client.aclose()
+
+
+async def create_conversation(conversation_id: str, user_id: str = "default") -> Dict[str, Any]:
     """
     Create a new conversation.
 
@@ -35,22 +206,18 @@ def create_conversation(conversation_id: str, user_id: str = "default") -> Dict[
         "created_at": datetime.utcnow().isoformat()
     }
     
-    response = httpx.post(
-        f"{SUPABASE_URL}/rest/v1/conversations",
-        headers=_get_headers(),
-        json=conversation
-    )
+    response = await _client.post(_CONVERSATIONS, json=conversation, headers=_RETURN_REPRESENTATION)
     
     if response.status_code == 201:
         data = response.json()
         return data[0] if data else conversation
     else:
-        print(f"Error creating conversation: {response.status_code} - {response.text}")
+        logger.error("Error creating conversation: %s - %s", response.status_code, response.text)
         # Return the conversation anyway for local fallback
         return conversation
 
 
-def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+async def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
     """
     Load a conversation from storage.
 
@@ -60,74 +227,94 @@ def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
     Returns:
         Conversation dict or None if not found
     """
-    response = httpx.get(
-        f"{SUPABASE_URL}/rest/v1/conversations?id=eq.{conversation_id}",
-        headers=_get_headers()
-    )
-    
-    if response.status_code == 200:
-        data = response.json()
-        if data:
-            return data[0]
-    return None
-
-
-def save_conversation(conversation: Dict[str, Any]):
-    """
-    Save a conversation to storage.
-
-    Args:
-        conversation: Conversation dict to save
-    """
-    response = httpx.patch(
-        f"{SUPABASE_URL}/rest/v1/conversations?id=eq.{conversation['id']}",
-        headers=_get_headers(),
-        json={
-            "title": conversation.get("title", "New Conversation"),
-            "messages": conversation.get("messages", [])
-        }
-    )
-    
-    if response.status_code not in [200, 204]:
-        print(f"Error saving conversation: {response.status_code} - {response.text}")
-
-
-def list_conversations(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    while True:
+        cached = _conversation_cache.get(conversation_id)
+        if cached is not None:
+            return cached
+
+        pending = _inflight.get(conversation_id)
+        if pending is None:
+            break
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            # The leader's request was cancelled, not ours: read again
+            if pending.cancelled():
+                continue
+            raise
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[conversation_id] = future
+    try:
+        conversation = None
+        response = await _client.get(
+            _CONVERSATIONS,
+            params={"id": f"eq.{conversation_id}", "select": _CONVERSATION_COLUMNS}
+        )
+        if response.status_code == 200:
+            data = response.json()
+            if data:
+                conversation = data[0]
+                messages = conversation.get("messages") or []
+                if _has_attachments(messages):
+                    await asyncio.to_thread(_decode_messages, messages)
+        # Only cache if no write invalidated this read while it was in flight
+        if (
+            conversation is not None
+            and _inflight.get(conversation_id) is future
+            and _approx_size(conversation) <= _CONVERSATION_CACHE_MAX_ROW_BYTES
+        ):
+            _conversation_cache[conversation_id] = conversation
+        future.set_result(conversation)
+        return conversation
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as e:
+        # Followers see the same failure rather than a missing conversation
+        future.set_exception(e)
+        future.exception()  # retrieved; don't warn when nobody was waiting
+        raise
+    finally:
+        if _inflight.get(conversation_id) is future:
+            del _inflight[conversation_id]
+
+
+async def list_conversations(
+    user_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0
+) -> List[Dict[str, Any]]:
     """
-    List conversations (metadata only), optionally filtered by user_id.
+    List conversations (metadata only), newest first, optionally filtered by user_id.
 
     Args:
         user_id: Optional user ID to filter conversations
+        limit: Maximum number of conversations to return, or None for all
+        offset: Number of conversations to skip, for paging
 
     Returns:
         List of conversation metadata dicts
     """
-    url = f"{SUPABASE_URL}/rest/v1/conversations?select=id,user_id,title,messages,created_at&order=created_at.desc"
+    params = {"select": "*", "order": "created_at.desc"}
     
     if user_id:
-        url += f"&user_id=eq.{user_id}"
+        params["user_id"] = f"eq.{user_id}"
+    if limit is not None:
+        params["limit"] = str(limit)
+    if offset:
+        params["offset"] = str(offset)
     
-    response = httpx.get(url, headers=_get_headers())
+    response = await _client.get(_CONVERSATIONS_META, params=params)
     
     if response.status_code == 200:
-        data = response.json()
-        # Convert to metadata format
-        return [
-            {
-                "id": conv["id"],
-                "user_id": conv.get("user_id", "default"),
-                "created_at": conv["created_at"],
-                "title": conv.get("title", "New Conversation"),
-                "message_count": len(conv.get("messages", []))
-            }
-            for conv in data
-        ]
+        return response.json()
     
-    print(f"Error listing conversations: {response.status_code} - {response.text}")
+    logger.error("Error listing conversations: %s - %s", response.status_code, response.text)
     return []
 
 
-def delete_conversation(conversation_id: str) -> bool:
+async def delete_conversation(conversation_id: str) -> bool:
     """
     Delete a conversation.
 
@@ -137,29 +324,47 @@ def delete_conversation(conversation_id: str) -> bool:
     Returns:
         True if deleted, False if not found
     """
-    response = httpx.delete(
-        f"{SUPABASE_URL}/rest/v1/conversations?id=eq.{conversation_id}",
-        headers=_get_headers()
-    )
+    with _invalidating(conversation_id):
+        response = await _client.delete(_CONVERSATIONS, params={"id": f"eq.{conversation_id}"})
     
     return response.status_code in [200, 204]
 
 
-def add_user_message(conversation_id: str, content: str, attachments: List[Dict[str, Any]] = None):
+async def append_message(conversation_id: str, message: Dict[str, Any]):
     """
-    Add a user message to a conversation.
+    Append a message to a conversation server-side (append_message RPC).
 
     Args:
         conversation_id: Conversation identifier
-        content: User message content
-        attachments: Optional list of attachments
+        message: Message dict to append
+
+    Raises:
+        ValueError: If the conversation does not exist
     """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
+    [message] = await _prepare_messages([message])
+    with _invalidating(conversation_id):
+        response = await _client.post(
+            _RPC_APPEND_MESSAGE,
+            json={"conv_id": conversation_id, "msg": message}
+        )
+
+    if response.status_code == 404:
         raise ValueError(f"Conversation {conversation_id} not found")
+    if response.status_code not in [200, 204]:
+        logger.error("Error appending message: %s - %s", response.status_code, response.text)
 
-    messages = conversation.get("messages", [])
-    
+
+def build_user_message(content: str, attachments: List[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Build a stored user message.
+
+    Args:
+        content: User message content
+        attachments: Optional list of attachments
+
+    Returns:
+        User message dict
+    """
     message = {
         "role": "user",
         "content": content
@@ -167,57 +372,66 @@ def add_user_message(conversation_id: str, content: str, attachments: List[Dict[
     
     if attachments:
         message["attachments"] = attachments
-        
-    messages.append(message)
-    
-    conversation["messages"] = messages
-    save_conversation(conversation)
 
+    return message
 
-def add_assistant_message(
-    conversation_id: str,
+
+def build_assistant_message(
     stage1: List[Dict[str, Any]],
     stage2: List[Dict[str, Any]],
     stage3: Dict[str, Any]
-):
+) -> Dict[str, Any]:
     """
-    Add an assistant message with all 3 stages to a conversation.
+    Build a stored assistant message with all 3 stages.
 
     Args:
-        conversation_id: Conversation identifier
         stage1: List of individual model responses
         stage2: List of model rankings
         stage3: Final synthesized response
-    """
-    conversation = get_conversation(conversation_id)
-    if conversation is None:
-        raise ValueError(f"Conversation {conversation_id} not found")
 
-    messages = conversation.get("messages", [])
-    messages.append({
+    Returns:
+        Assistant message dict
+    """
+    return {
         "role": "assistant",
         "stage1": stage1,
         "stage2": stage2,
         "stage3": stage3
-    })
-    
-    conversation["messages"] = messages
-    save_conversation(conversation)
+    }
 
 
-def update_conversation_title(conversation_id: str, title: str):
+async def finalize_turn(
+    conversation_id: str,
+    user_message: Dict[str, Any],
+    assistant_message: Dict[str, Any],
+    title: Optional[str] = None
+):
     """
-    Update the title of a conversation.
+    Save a completed turn in one request (finalize_turn RPC).
 
     Args:
         conversation_id: Conversation identifier
-        title: New title for the conversation
+        user_message: User message dict (see build_user_message)
+        assistant_message: Assistant message dict (see build_assistant_message)
+        title: New title, or None to keep the current one
+
+    Raises:
+        ValueError: If the conversation does not exist
+        RuntimeError: If Supabase rejects the write
     """
-    response = httpx.patch(
-        f"{SUPABASE_URL}/rest/v1/conversations?id=eq.{conversation_id}",
-        headers=_get_headers(),
-        json={"title": title}
-    )
-    
+    user_message, assistant_message = await _prepare_messages([user_message, assistant_message])
+    with _invalidating(conversation_id):
+        response = await _client.post(
+            _RPC_FINALIZE_TURN,
+            json={
+                "conv_id": conversation_id,
+                "user_msg": user_message,
+                "assistant_msg": assistant_message,
+                "new_title": title
+            }
+        )
+
+    if response.status_code == 404:
+        raise ValueError(f"Conversation {conversation_id} not found")
     if response.status_code not in [200, 204]:
-        print(f"Error updating title: {response.status_code} - {response.text}")
+        raise RuntimeError(f"Error saving turn: {response.status_code} - {response.text}")
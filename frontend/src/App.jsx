@@ -128,6 +128,38 @@ function App() {
             });
             break;
 
+          case 'stage1_token':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              const lastMsg = messages[messages.length - 1];
+              const partial = [...(lastMsg.stage1 || [])];
+              const index = partial.findIndex((r) => r.model === event.model);
+              if (index === -1) {
+                partial.push({ model: event.model, response: event.delta });
+              } else {
+                partial[index] = { ...partial[index], response: partial[index].response + event.delta };
+              }
+              messages[messages.length - 1] = { ...lastMsg, stage1: partial };
+              return { ...prev, messages };
+            });
+            break;
+
+          case 'stage1_partial':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              const lastMsg = messages[messages.length - 1];
+              const partial = [...(lastMsg.stage1 || [])];
+              const index = partial.findIndex((r) => r.model === event.data.model);
+              if (index === -1) {
+                partial.push(event.data);
+              } else {
+                partial[index] = event.data;
+              }
+              messages[messages.length - 1] = { ...lastMsg, stage1: partial };
+              return { ...prev, messages };
+            });
+            break;
+
           case 'stage1_complete':
             setCurrentConversation((prev) => {
               const messages = [...prev.messages];
@@ -143,6 +175,18 @@ function App() {
               const messages = [...prev.messages];
               const lastMsg = messages[messages.length - 1];
               lastMsg.loading.stage2 = true;
+              if (event.metadata) {
+                lastMsg.metadata = event.metadata;
+              }
+              return { ...prev, messages };
+            });
+            break;
+
+          case 'stage2_partial':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              const lastMsg = messages[messages.length - 1];
+              messages[messages.length - 1] = { ...lastMsg, stage2: [...(lastMsg.stage2 || []), event.data] };
               return { ...prev, messages };
             });
             break;
@@ -167,6 +211,16 @@ function App() {
             });
             break;
 
+          case 'stage3_token':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              const lastMsg = messages[messages.length - 1];
+              const response = (lastMsg.stage3?.response || '') + event.delta;
+              messages[messages.length - 1] = { ...lastMsg, stage3: { model: event.model, response } };
+              return { ...prev, messages };
+            });
+            break;
+
           case 'stage3_complete':
             setCurrentConversation((prev) => {
               const messages = [...prev.messages];
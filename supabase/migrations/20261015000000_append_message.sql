@@ -0,0 +1,20 @@
+-- Append one message to a conversation in place.
+--
+-- The backend previously fetched the whole conversation and PATCHed back the
+-- full messages array for every new message; with this function only the new
+-- message travels over the wire. Raises when the conversation does not exist
+-- (as HTTP 404 since 20261015000400_not_found_status.sql).
+create or replace function public.append_message(conv_id uuid, msg jsonb)
+returns void
+language plpgsql
+as $$
+begin
+  update public.conversations
+     set messages = coalesce(messages, '[]'::jsonb) || jsonb_build_array(msg)
+   where id = conv_id;
+
+  if not found then
+    raise exception 'Conversation % not found', conv_id using errcode = 'P0002';
+  end if;
+end;
+$$;
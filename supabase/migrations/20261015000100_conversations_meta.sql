@@ -0,0 +1,13 @@
+-- Conversation list metadata without the message bodies.
+--
+-- list_conversations only needs a message count; selecting from this view
+-- keeps every message out of the list response.
+create or replace view public.conversations_meta
+with (security_invoker = on) as
+select
+  id,
+  coalesce(user_id, 'default') as user_id,
+  coalesce(title, 'New Conversation') as title,
+  created_at,
+  coalesce(jsonb_array_length(messages), 0) as message_count
+from public.conversations;
@@ -0,0 +1,26 @@
+-- Persist a whole council turn in one statement.
+--
+-- Appends the user and assistant messages together and, on the first turn,
+-- sets the generated title. Replaces the separate append/title requests the
+-- backend used to make per turn. Raises when the conversation does not
+-- exist (as HTTP 404 since 20261015000400_not_found_status.sql).
+create or replace function public.finalize_turn(
+  conv_id uuid,
+  user_msg jsonb,
+  assistant_msg jsonb,
+  new_title text default null
+)
+returns void
+language plpgsql
+as $$
+begin
+  update public.conversations
+     set messages = coalesce(messages, '[]'::jsonb) || jsonb_build_array(user_msg, assistant_msg),
+         title = coalesce(new_title, title)
+   where id = conv_id;
+
+  if not found then
+    raise exception 'Conversation % not found', conv_id using errcode = 'P0002';
+  end if;
+end;
+$$;
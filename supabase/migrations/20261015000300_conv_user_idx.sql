@@ -0,0 +1,30 @@
+-- Per-user conversation list index.
+--
+-- list_conversations filters on user_id and orders by created_at desc with a
+-- limit; this index serves it as an ordered range scan that stops after
+-- `limit` rows instead of a sequential scan plus sort.
+--
+--   explain analyze
+--   select * from public.conversations_meta
+--   where user_id = 'user_x' order by created_at desc limit 50;
+create index if not exists conversations_user_created_idx
+  on public.conversations (user_id, created_at desc);
+
+-- Filter on the raw column so the planner can use the index; coalescing it
+-- in the view hid user_id behind an expression. Backfill the legacy NULLs
+-- the coalesce used to cover, and keep new rows from having any.
+update public.conversations set user_id = 'default' where user_id is null;
+
+alter table public.conversations
+  alter column user_id set default 'default',
+  alter column user_id set not null;
+
+create or replace view public.conversations_meta
+with (security_invoker = on) as
+select
+  id,
+  user_id,
+  coalesce(title, 'New Conversation') as title,
+  created_at,
+  coalesce(jsonb_array_length(messages), 0) as message_count
+from public.conversations;
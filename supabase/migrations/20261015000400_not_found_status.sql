@@ -0,0 +1,40 @@
+-- Report a missing conversation as HTTP 404.
+--
+-- PostgREST maps no_data_found (P0002) to 500; only PT-prefixed SQLSTATEs
+-- set a custom status. Re-create append_message and finalize_turn raising
+-- PT404 so the backend can tell a missing conversation from a failed write.
+create or replace function public.append_message(conv_id uuid, msg jsonb)
+returns void
+language plpgsql
+as $$
+begin
+  update public.conversations
+     set messages = coalesce(messages, '[]'::jsonb) || jsonb_build_array(msg)
+   where id = conv_id;
+
+  if not found then
+    raise exception 'Conversation % not found', conv_id using errcode = 'PT404';
+  end if;
+end;
+$$;
+
+create or replace function public.finalize_turn(
+  conv_id uuid,
+  user_msg jsonb,
+  assistant_msg jsonb,
+  new_title text default null
+)
+returns void
+language plpgsql
+as $$
+begin
+  update public.conversations
+     set messages = coalesce(messages, '[]'::jsonb) || jsonb_build_array(user_msg, assistant_msg),
+         title = coalesce(new_title, title)
+   where id = conv_id;
+
+  if not found then
+    raise exception 'Conversation % not found', conv_id using errcode = 'PT404';
+  end if;
+end;
+$$;
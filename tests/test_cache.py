@@ -0,0 +1,74 @@
+"""Single-flight behaviour of the LLM response cache."""
+
+import asyncio
+
+import pytest
+
+import cache
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(cache, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(cache, "_redis", None)
+    cache._local_cache.clear()
+    cache._inflight.clear()
+
+
+def test_concurrent_calls_share_one_request():
+    calls = []
+
+    @cache.cached_call
+    async def query(model, messages):
+        calls.append(model)
+        await asyncio.sleep(0.01)
+        return {"content": "answer"}
+
+    async def run():
+        return await asyncio.gather(query("m", MESSAGES), query("m", MESSAGES))
+
+    assert asyncio.run(run()) == [{"content": "answer"}] * 2
+    assert calls == ["m"]
+
+
+def test_follower_takes_over_when_leader_is_cancelled():
+    calls = []
+
+    @cache.cached_call
+    async def query(model, messages):
+        calls.append(model)
+        await asyncio.sleep(0.05)
+        return {"content": "answer"}
+
+    async def run():
+        leader = asyncio.create_task(query("m", MESSAGES))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(query("m", MESSAGES))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower, leader.cancelled()
+
+    assert asyncio.run(run()) == ({"content": "answer"}, True)
+    assert calls == ["m", "m"]
+
+
+def test_follower_takes_over_when_leader_raises():
+    calls = []
+
+    @cache.cached_call
+    async def query(model, messages):
+        calls.append(model)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise RuntimeError("upstream failed")
+        return {"content": "answer"}
+
+    async def run():
+        return await asyncio.gather(query("m", MESSAGES), query("m", MESSAGES), return_exceptions=True)
+
+    leader, follower = asyncio.run(run())
+    assert isinstance(leader, RuntimeError)
+    assert follower == {"content": "answer"}
+    assert len(calls) == 2
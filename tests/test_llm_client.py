@@ -0,0 +1,67 @@
+"""Streaming fallbacks and stall handling in llm_client."""
+
+import asyncio
+
+import httpx
+
+import llm_client
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def fake_query(schedule):
+    """Stand-in for query_model: stream each model's deltas at the given delays (s)."""
+    async def query(model, messages, on_delta=None):
+        for delay in schedule[model]:
+            await asyncio.sleep(delay)
+            on_delta("x")
+        return {"content": model}
+    return query
+
+
+def collect(**kwargs):
+    async def run():
+        return {model async for model, _ in llm_client.iter_models_firstN(["a", "b", "c"], MESSAGES, **kwargs)}
+    return asyncio.run(run())
+
+
+def test_late_first_token_is_waited_for(monkeypatch):
+    # "c" thinks silently for a while before streaming, like a reasoning model
+    monkeypatch.setattr(llm_client, "query_model", fake_query({"a": [0.01], "b": [0.01], "c": [0.15, 0.01]}))
+    assert collect(min_responses=2, grace_ms=50, first_token_ms=1000) == {"a", "b", "c"}
+
+
+def test_silent_model_is_dropped_after_first_token_deadline(monkeypatch):
+    monkeypatch.setattr(llm_client, "query_model", fake_query({"a": [0.01], "b": [0.01], "c": [5]}))
+    assert collect(min_responses=2, grace_ms=50, first_token_ms=100) == {"a", "b"}
+
+
+def test_model_that_stops_streaming_is_dropped(monkeypatch):
+    monkeypatch.setattr(llm_client, "query_model", fake_query({"a": [0.01], "b": [0.01], "c": [0.01, 5]}))
+    assert collect(min_responses=2, grace_ms=50, first_token_ms=1000) == {"a", "b"}
+
+
+def rejected_stream(status):
+    async def stream():
+        request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+        raise httpx.HTTPStatusError("rejected", request=request, response=httpx.Response(status, request=request))
+        yield
+    return stream()
+
+
+def test_rejected_stream_falls_back_to_plain_request():
+    deltas = []
+
+    async def fallback():
+        return {"content": "answer", "reasoning_details": None}
+
+    response = asyncio.run(llm_client._collect_stream("openai/gpt-5", rejected_stream(400), deltas.append, fallback))
+    assert response["content"] == "answer"
+    assert deltas == ["answer"]
+
+
+def test_server_error_does_not_fall_back():
+    async def fallback():
+        raise AssertionError("should not be called")
+
+    assert asyncio.run(llm_client._collect_stream("openai/gpt-5", rejected_stream(503), print, fallback)) is None
@@ -0,0 +1,42 @@
+"""Stage 2 similarity check on real encoder output (needs the semantic-cache extra)."""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("faiss")
+
+import semantic_cache
+from config import STAGE2_SKIP_SIMILARITY
+
+# Two long answers to the same question that disagree: each spans several
+# encoder chunks, so pooling would pull them together if it were unbounded
+FRENCH_PRESS = " ".join([
+    "Use a French press. Grind the beans coarse, about the texture of sea salt.",
+    "Heat water to just off the boil, around 94 degrees Celsius.",
+    "Add 60 grams of coffee per litre, pour the water, and stir once.",
+    "Put the lid on and steep for four minutes without touching it.",
+    "Press the plunger down slowly and serve immediately so it does not over-extract.",
+] * 8)
+ESPRESSO = " ".join([
+    "Skip immersion brewing and pull an espresso shot instead.",
+    "Dial in a very fine grind and dose 18 grams into the portafilter basket.",
+    "Tamp evenly with firm pressure and lock the group head.",
+    "Extract about 36 grams of liquid in 25 to 30 seconds at nine bars of pressure.",
+    "Steam milk to 60 degrees for a flat white, or drink the shot straight.",
+] * 8)
+
+
+def test_differing_same_topic_answers_are_not_skipped():
+    similarity = asyncio.run(semantic_cache.min_pairwise_similarity([FRENCH_PRESS, ESPRESSO]))
+    if similarity is None:
+        pytest.skip("sentence-transformer model could not be loaded")
+    assert similarity < STAGE2_SKIP_SIMILARITY
+
+
+def test_identical_answers_are_skipped():
+    similarity = asyncio.run(semantic_cache.min_pairwise_similarity([ESPRESSO, ESPRESSO]))
+    if similarity is None:
+        pytest.skip("sentence-transformer model could not be loaded")
+    assert similarity >= STAGE2_SKIP_SIMILARITY
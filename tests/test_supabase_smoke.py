@@ -0,0 +1,55 @@
+"""
+Smoke test against a live Supabase project.
+
+Runs a conversation through supabase_storage (create, finalize_turn, read,
+list, delete) using a fresh id, so an earlier crashed run can't collide
+with it. Writes to the project in SUPABASE_URL / SUPABASE_KEY, so it is
+deselected by default; run it with `pytest -m supabase`.
+"""
+
+import asyncio
+import os
+import uuid
+
+import pytest
+
+import supabase_storage as storage
+
+pytestmark = [
+    pytest.mark.supabase,
+    pytest.mark.skipif(
+        not (os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY")),
+        reason="SUPABASE_URL and SUPABASE_KEY are not set",
+    ),
+]
+
+
+async def _round_trip(conversation_id: str):
+    try:
+        await storage.create_conversation(conversation_id, user_id="smoke-test")
+        try:
+            await storage.finalize_turn(
+                conversation_id,
+                storage.build_user_message("ping"),
+                storage.build_assistant_message([], [], {"model": "smoke-test", "response": "pong"}),
+                "Smoke test"
+            )
+            conversation = await storage.get_conversation(conversation_id)
+            listed = await storage.list_conversations(user_id="smoke-test")
+        finally:
+            deleted = await storage.delete_conversation(conversation_id)
+    finally:
+        await storage.aclose()
+
+    return conversation, listed, deleted
+
+
+def test_conversation_round_trip():
+    conversation_id = str(uuid.uuid4())
+    conversation, listed, deleted = asyncio.run(_round_trip(conversation_id))
+
+    assert conversation is not None, "conversation was not created"
+    assert conversation["title"] == "Smoke test"
+    assert [message["role"] for message in conversation["messages"]] == ["user", "assistant"]
+    assert conversation_id in {item["id"] for item in listed}
+    assert deleted